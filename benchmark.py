@@ -0,0 +1,351 @@
+"""Headless viewer benchmark.
+
+Generates a synthetic tile set, then replays scripted traces (cold start, steady pan, zoom sweep,
+floor switching) through the real viewer loop under SDL's dummy video driver, each trace in its own
+process. Prints one JSON document with frame-time percentiles, load throughput, time to first frame
+and peak RSS per trace.
+
+    python benchmark.py --traces pan zoom --output bench.json
+    python benchmark.py --compact both  # each trace with full and compact tiles, for the memory/frame-time tradeoff
+    python benchmark.py --tile-server  # fetch the tiles from a local tile_server.py instead of the directory
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import multiprocessing
+import os
+import queue
+import random
+import socket
+import sys
+import tempfile
+import time
+
+os.environ["SDL_VIDEODRIVER"] = "dummy"  # no window, must be set before pygame initializes
+os.environ["SDL_AUDIODRIVER"] = "dummy"
+os.environ["PYGAME_HIDE_SUPPORT_PROMPT"] = "1"
+
+import pygame
+
+try:
+    import resource
+except ImportError:  # Not available on Windows, peak RSS is reported as None there
+    resource = None
+
+import map_tools
+import tile_server
+import viewer
+
+# === Constants ===
+# Synthetic tile set, centred on the viewer's INIT_CENTER so the initial load finds tiles
+BENCH_PLANES = 2
+BENCH_RADIUS = 12  # tiles either side of INIT_CENTER
+BENCH_UNIFORM_FRACTION = 0.3  # share of single-colour tiles, like open ocean in the real map
+BENCH_SEED = 2025
+
+# Traces
+BENCH_WINDOW_SIZE = (1600, 900)
+COLD_START_TIMEOUT = 30.0  # seconds, the cold start trace otherwise ends once the view is complete and loading stops
+PAN_FRAMES = 300
+PAN_STEP = 12  # pixels dragged per frame
+FLOOR_SWITCHES = 8
+FLOOR_SWITCH_INTERVAL = 1.0  # seconds between floor changes
+SETTLE_FRAMES = 10  # frames to hold each zoom level once the animation has finished
+TRACE_FRAME_LIMIT = 2000  # safety stop for traces that wait on the viewer
+BENCH_IDLE_POLL = viewer.RENDER_LOADING_POLL  # viewer.RENDER_IDLE_POLL for the traces, so waits end close to when loading does
+
+
+# === Synthetic Tiles ===
+def generate_tiles(tile_dir, pyramid):
+    """Write a deterministic synthetic z_x_y.png tile set, its manifest and optionally a zoom pyramid."""
+    rng = random.Random(BENCH_SEED)
+    pygame.init()
+
+    center_x, center_y = viewer.INIT_CENTER
+    for z in range(BENCH_PLANES):
+        for x in range(center_x - BENCH_RADIUS, center_x + BENCH_RADIUS + 1):
+            for y in range(center_y - BENCH_RADIUS, center_y + BENCH_RADIUS + 1):
+                tile = pygame.Surface((map_tools.TILE_SIZE, map_tools.TILE_SIZE))
+                tile.fill((20, 40, 90))
+                if rng.random() >= BENCH_UNIFORM_FRACTION:
+                    # Blocky detail compresses roughly like real map tiles
+                    for _ in range(64):
+                        colour = (rng.randrange(256), rng.randrange(256), rng.randrange(256))
+                        rect = (rng.randrange(256), rng.randrange(256), rng.randrange(8, 64), rng.randrange(8, 64))
+                        pygame.draw.rect(tile, colour, rect)
+                pygame.image.save(tile, os.path.join(tile_dir, f"{z}_{x}_{y}.png"))
+
+    pygame.quit()
+
+    map_tools.MAP_TILE_DIR = tile_dir
+    map_tools.load_manifest(tile_dir, refresh=True)
+    if pyramid:
+        map_tools.build_pyramid()
+
+
+# === Traces ===
+# A trace maps (frame, state, memo) to the events to post before that frame, or None once it is done.
+# memo is a dict the trace can keep its own progress in. run_trace also keeps "elapsed", the seconds
+# since the viewer started, and "settled", whether the view is complete and nothing is loading, in it
+def mouse_event(event_type, pos, **kwargs):
+    return pygame.event.Event(event_type, pos=pos, button=1, **kwargs)
+
+
+def cold_start_trace(frame, state, memo):
+    if memo["settled"] or memo["elapsed"] >= COLD_START_TIMEOUT:
+        return None
+    return []
+
+
+def pan_trace(frame, state, memo):
+    center = (state.window_width // 2, state.window_height // 2)
+    if frame == 0:
+        return [mouse_event(pygame.MOUSEBUTTONDOWN, center)]
+    if frame <= PAN_FRAMES:
+        pos = (center[0] - frame * PAN_STEP, center[1] - frame * PAN_STEP // 3)
+        return [pygame.event.Event(pygame.MOUSEMOTION, pos=pos, rel=(-PAN_STEP, -PAN_STEP // 3), buttons=(1, 0, 0))]
+    if frame == PAN_FRAMES + 1:
+        return [mouse_event(pygame.MOUSEBUTTONUP, center)]
+    return None
+
+
+def zoom_trace(frame, state, memo):
+    """Zoom out to the smallest level and back in to the largest, one wheel step per settled level."""
+    if frame >= TRACE_FRAME_LIMIT:
+        return None
+    if abs(state.zoom - state.zoom_target) > 0.001:
+        return []  # let the animation run
+
+    memo["settled_frames"] = memo.get("settled_frames", 0) + 1
+    if memo["settled_frames"] < SETTLE_FRAMES:
+        return []
+    memo["settled_frames"] = 0
+
+    zooming_out = memo.get("zooming_out", True)
+    if zooming_out and state.zoom_target == viewer.ZOOM_LEVELS[-1]:
+        memo["zooming_out"] = zooming_out = False
+    elif not zooming_out and state.zoom_target == viewer.ZOOM_LEVELS[0]:
+        return None
+    return [pygame.event.Event(pygame.MOUSEWHEEL, x=0, y=-1 if zooming_out else 1)]
+
+
+def floor_trace(frame, state, memo):
+    switches = memo.get("switches", 0)
+    if memo["elapsed"] < (switches + 1) * FLOOR_SWITCH_INTERVAL:
+        return []
+    if switches >= FLOOR_SWITCHES:
+        return None
+    memo["switches"] = switches + 1
+    key = pygame.K_UP if switches % 2 else pygame.K_DOWN
+    if state.current_z == viewer.Z_MIN:
+        key = pygame.K_UP
+    return [pygame.event.Event(pygame.KEYDOWN, key=key)]
+
+
+TRACES = {
+    "cold": cold_start_trace,
+    "pan": pan_trace,
+    "zoom": zoom_trace,
+    "floors": floor_trace,
+}
+
+
+# === Measurement ===
+def percentiles(values, points=(50, 90, 99)):
+    if not values:
+        return {}
+    ordered = sorted(values)
+    result = {f"p{p}": ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] for p in points}
+    result["max"] = ordered[-1]
+    result["mean"] = sum(ordered) / len(ordered)
+    return result
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024  # bytes on macOS, KiB elsewhere
+
+
+def view_complete(state, tile_cache, max_level):
+    """True once every tile that exists inside the window is resident."""
+    level = viewer.pyramid_level(state.zoom, max_level)
+    x_min, x_max, y_min, y_max = viewer.visible_tile_range(
+        state.offset, state.zoom, (state.window_width, state.window_height), level)
+    for x in range(x_min, x_max + 1):
+        for y in range(y_min, y_max + 1):
+            key = (state.current_z, x, y, level)
+            if key in tile_cache.present and key not in tile_cache.tiles:
+                return False
+    return True
+
+
+def run_trace(name, tile_dir, settings, results):
+    """Child process: run one trace through viewer.main and put its measurements on the results queue."""
+    # Keep the viewer's prints out of the JSON. At the descriptor level, since loader threads still
+    # blocked on a tile when main returns can print until the process exits
+    os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    viewer.MAP_TILE_DIR = tile_dir
+    viewer.RENDER_IDLE_POLL = BENCH_IDLE_POLL
+    for setting, value in settings.items():
+        setattr(viewer, setting, value)
+
+    trace = TRACES[name]
+    memo = {}
+    frames = []  # (callback entered, viewer resumed, frames drawn so far) per frame
+    measured = {"time_to_view_complete_s": None, "loading_done": None}
+
+    def on_frame(frame, state, tile_cache, scheduler):
+        now = time.perf_counter()
+        if "max_level" not in measured:  # the benchmark does not build pyramid levels while it runs
+            measured["max_level"] = viewer.detect_pyramid_levels(tile_cache.present)
+        complete = frame > 0 and view_complete(state, tile_cache, measured["max_level"])
+        if measured["time_to_view_complete_s"] is None and complete:
+            measured["time_to_view_complete_s"] = now - start
+
+        # Throughput counts the loads up to the first time the queue drains, not the idle time after it
+        idle = scheduler.idle()
+        loads = tile_cache.loads
+        if measured["loading_done"] is None and idle and loads:
+            measured["loading_done"] = (now - start, loads)
+
+        memo["elapsed"] = now - start
+        memo["settled"] = complete and idle
+        events = trace(frame, state, memo)
+        if events is None:
+            measured["cache"] = tile_cache.stats()
+            measured["scheduler"] = scheduler.stats()
+            measured["startup"] = dict(state.startup)
+        else:
+            for event in events:
+                pygame.event.post(event)
+
+        # Frame times run from here to the next call, so this callback's own work is not in them
+        frames.append((now, time.perf_counter(), state.frames_drawn))
+        return events is not None
+
+    start = time.perf_counter()
+    viewer.main(window_size=BENCH_WINDOW_SIZE, frame_callback=on_frame)
+    # Traces that end while still loading count everything loaded up to their last frame
+    loading_s, loads = measured["loading_done"] or (frames[-1][0] - start, measured["cache"]["loads"])
+
+    # The viewer skips frames where nothing changed and sleeps instead, only time the drawn ones
+    frame_ms = [(b - a) * 1000 for (_, a, drawn_a), (b, _, drawn_b) in zip(frames, frames[1:])
+                if drawn_b > drawn_a]
+    first_frame = next((t for t, _, drawn in frames if drawn), None)
+    results.put({
+        "trace": name,
+        "compact": viewer.COMPACT_TILES,
+        "frames": len(frame_ms),
+        "idle_frames": len(frames) - 1 - len(frame_ms),
+        "frame_ms": percentiles(frame_ms),
+        "time_to_first_frame_s": first_frame - start if first_frame is not None else None,
+        "time_to_view_complete_s": measured["time_to_view_complete_s"],
+        "startup_ms": {phase: seconds * 1000 for phase, seconds in measured["startup"].items()},
+        "tiles_loaded": measured["cache"]["loads"],
+        "tiles_per_second": loads / loading_s if loading_s > 0 else None,
+        "loading_s": loading_s,
+        "peak_rss_mb": peak_rss_mb(),
+        "tile_cache_mb": measured["cache"]["bytes"] / (1024 * 1024),
+        "cache": measured["cache"],
+        "scheduler": measured["scheduler"],
+    })
+
+
+def run_tile_server(tile_dir, port, ready):
+    """Child process: serve the tile set with tile_server.py until terminated."""
+    with contextlib.redirect_stdout(sys.stderr):
+        asyncio.run(tile_server.serve(tile_dir, tile_server.SERVER_HOST, port, ready))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind((tile_server.SERVER_HOST, 0))
+        return s.getsockname()[1]
+
+
+# === Main ===
+def main():
+    parser = argparse.ArgumentParser(description="Replay scripted traces through the viewer headlessly.")
+    parser.add_argument("--traces", nargs="+", choices=sorted(TRACES), default=list(TRACES))
+    parser.add_argument("--tile-dir", help="existing tile directory to use instead of a synthetic set")
+    parser.add_argument("--pyramid", action="store_true", help="build a zoom pyramid for the synthetic set")
+    parser.add_argument("--decode-workers", type=int, help="override viewer.DECODE_WORKERS")
+    parser.add_argument("--cache-mb", type=int, help="override viewer.TILE_CACHE_MAX_BYTES, in MiB")
+    parser.add_argument("--compact", choices=["off", "on", "both"], default="off",
+                        help="run with viewer.COMPACT_TILES off, on, or each trace both ways")
+    parser.add_argument("--preload", action="store_true",
+                        help="decode the INIT_CENTER block before the first frame, viewer.FAST_STARTUP off")
+    parser.add_argument("--tile-server", action="store_true",
+                        help="serve the tiles from a local tile_server.py and set viewer.TILE_SERVER_URL")
+    parser.add_argument("--output", help="also write the JSON results to this file")
+    parser.add_argument("--profile-dir", help="write each trace's per-frame profile to <trace>.csv in this directory")
+    args = parser.parse_args()
+
+    settings = {}
+    if args.decode_workers is not None:
+        settings["DECODE_WORKERS"] = args.decode_workers
+    if args.cache_mb is not None:
+        settings["TILE_CACHE_MAX_BYTES"] = args.cache_mb * 1024 * 1024
+    if args.preload:
+        settings["FAST_STARTUP"] = False
+
+    with tempfile.TemporaryDirectory(prefix="osrs_bench_") as scratch:
+        tile_dir = args.tile_dir
+        if tile_dir is None:
+            tile_dir = scratch
+            with contextlib.redirect_stdout(sys.stderr):
+                generate_tiles(tile_dir, args.pyramid)
+
+        # One process per trace, so caches and peak RSS do not carry over between traces
+        context = multiprocessing.get_context("spawn")
+        results = context.Queue()
+
+        # The server outlives the traces, so later traces find its response cache warm like a shared server's
+        server = None
+        if args.tile_server:
+            port = free_port()
+            ready = context.Event()
+            server = context.Process(target=run_tile_server, args=(tile_dir, port, ready), daemon=True)
+            server.start()
+            if not ready.wait(60):
+                sys.exit("Tile server did not start")
+            settings["TILE_SERVER_URL"] = f"http://{tile_server.SERVER_HOST}:{port}"
+
+        report = {"settings": settings, "window_size": BENCH_WINDOW_SIZE, "traces": []}
+        compact_modes = {"off": [False], "on": [True], "both": [False, True]}[args.compact]
+        for name in args.traces:
+            for compact in compact_modes:
+                trace_settings = dict(settings, COMPACT_TILES=compact)
+                if args.profile_dir:
+                    os.makedirs(args.profile_dir, exist_ok=True)
+                    profile_name = f"{name}-compact.csv" if compact else f"{name}.csv"
+                    trace_settings["PROFILER_LOG_PATH"] = os.path.join(args.profile_dir, profile_name)
+                process = context.Process(target=run_trace, args=(name, tile_dir, trace_settings, results))
+                process.start()
+                while True:
+                    try:
+                        report["traces"].append(results.get(timeout=1))
+                        break
+                    except queue.Empty:
+                        if not process.is_alive():
+                            report["traces"].append(
+                                {"trace": name, "compact": compact, "error": f"exit code {process.exitcode}"})
+                            break
+                process.join()
+
+        if server is not None:
+            server.terminate()
+            server.join()
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
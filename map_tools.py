@@ -1,70 +1,353 @@
+import hashlib
+import io
+import json
+import mmap
+import multiprocessing
 import os
 import re
 import pygame
 import shutil
-from collections import Counter
+import struct
+import time
+import zlib
+from collections import Counter, deque
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, uniform colour checks fall back to reading pixels one by one
+    np = None
 
 MAP_TILE_DIR = "/mnt/c/Users/andre/Downloads/OSRS_map_rip/2025-05-22"
 TILE_SIZE = 256
 
-# === Map Bounds Function ===
-def get_bounds():
-    min_x = min_y = float("inf")
-    max_x = max_y = float("-inf")
-    total_files = 0
+# Zoom pyramid, level n tiles each cover 2^n x 2^n full-resolution tiles
+PYRAMID_DIR_NAME = "pyramid"
+PYRAMID_LEVELS = 3  # enough for the viewer's smallest zoom level of 0.125x
+
+# Tile manifest, lists the tiles present on disk so nothing has to re-list the directory
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+TILE_NAME_PATTERN = re.compile(r"^(\d+)_(\d+)_(\d+)\.png$")
+
+# Worker processes for the scans that decode or hash every tile
+SCAN_WORKERS = os.cpu_count() or 1
+
+# Monochrome scan
+MONOCHROME_MAX_FILE_BYTES = 16 * 1024  # a uniform tile deflates far below this, bigger files are never decoded
+
+# Dedup index, maps every tile to a hash of its pixels so identical tiles can share one copy
+DEDUP_INDEX_NAME = "dedup.json"
+DEDUP_INDEX_VERSION = 1
+
+# Corrupt tile scan, remembers tiles that passed so repeat runs only check new or changed files
+VALIDATION_STATE_NAME = "validation_state.json"
+VALIDATION_STATE_VERSION = 1
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}  # samples per pixel by colour type
+
+# Tile archive, every tile in one file with a (z, x, y, level) index
+ARCHIVE_NAME = "tiles.pack"
+ARCHIVE_MAGIC = b"OSRSPACK"
+ARCHIVE_VERSION = 1
+ARCHIVE_HEADER = struct.Struct("<8sHHHHIQ")  # magic, version, payload format, tile size, reserved, entries, index offset
+ARCHIVE_ENTRY = struct.Struct("<BBhhQI")  # z, level, x, y, payload offset, payload length
+ARCHIVE_RAW = 0  # payloads are decoded RGB, tile size x tile size x 3 bytes
+ARCHIVE_ZLIB = 1  # payloads are zlib compressed decoded RGB
+
+# Stitched map export
+EXPORT_DIR_NAME = "exports"
+EXPORT_BACKGROUND = (0, 0, 0)  # fill for missing tiles
+EXPORT_BANDS_IN_FLIGHT = 2  # bands per worker decoded ahead of the writer, bounds memory use
+EXPORT_COMPRESS_LEVEL = 6
+
+
+# === Tile Manifest ===
+# Layout of manifest.json:
+#   "levels":    {level: {z: {"x_y": [size, mtime_ns]}}}, level 0 being the full-resolution tiles
+#   "bounds":    {"z_min", "z_max", "x_min", "x_max", "y_min", "y_max"} of the level 0 tiles
+#   "planes":    {z: {"count", "x_min", "x_max", "y_min", "y_max"}} of the level 0 tiles
+#   "unmatched": .png files in the base directory not named z_x_y.png
+#   "dir_mtimes": {level: mtime_ns} of each level directory when it was listed, null if it did not exist
+def pyramid_level_dir(level, tile_dir=None):
+    """Directory holding the tiles of a pyramid level, level 0 being the full-resolution tiles."""
+    tile_dir = tile_dir or MAP_TILE_DIR
+    if level == 0:
+        return tile_dir
+    return os.path.join(tile_dir, PYRAMID_DIR_NAME, str(level))
+
+
+def manifest_path(tile_dir=None):
+    tile_dir = tile_dir or MAP_TILE_DIR
+    return os.path.join(tile_dir, MANIFEST_NAME)
+
+
+def scan_manifest(tile_dir=None):
+    """List the tile directory and its pyramid levels once and build a fresh manifest from it."""
+    manifest = {"version": MANIFEST_VERSION, "levels": {}, "unmatched": [], "dir_mtimes": {}}
+    rescan_levels(manifest, range(PYRAMID_LEVELS + 1), tile_dir)
+    return manifest
 
-    # Loop through each file in the base directory
-    for filename in os.listdir(MAP_TILE_DIR):
-        if not filename.lower().endswith(".png"):
-            continue  # Only process .png files
 
-        # Split the filename like 'z_x_y.png' into its components
+def dir_mtime(path):
+    """mtime_ns of a directory, None if it does not exist."""
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def rescan_levels(manifest, levels, tile_dir=None):
+    """List the given level directories again, replacing their entries in the manifest."""
+    tile_dir = tile_dir or MAP_TILE_DIR
+    for level in levels:
+        level_dir = pyramid_level_dir(level, tile_dir)
+        # The mtime is read before listing, so a change during the listing makes the level stale again
+        mtime = dir_mtime(level_dir)
+        unmatched = []
+        if mtime is None:
+            manifest["levels"].pop(str(level), None)
+        else:
+            manifest["levels"][str(level)] = scan_level(level_dir, unmatched)
+        if level == 0:
+            manifest["unmatched"] = unmatched
+        manifest.setdefault("dir_mtimes", {})[str(level)] = mtime
+    update_manifest_bounds(manifest)
+
+
+def current_dir_mtimes(manifest, tile_dir=None):
+    """{level: mtime_ns now} of the level directories unchanged since the manifest listed them, one stat per level."""
+    tile_dir = tile_dir or MAP_TILE_DIR
+    recorded = manifest.get("dir_mtimes", {})
+    # Saving the manifest into the tile directory moves the directory's mtime too, up to the manifest's ctime
+    try:
+        saved = os.stat(manifest_path(tile_dir)).st_ctime_ns
+    except FileNotFoundError:  # never saved, the tile directory is read-only
+        saved = None
+    current = {}
+    for level in range(PYRAMID_LEVELS + 1):
+        mtime = dir_mtime(pyramid_level_dir(level, tile_dir))
+        known = recorded.get(str(level), False)  # False for manifests written before dir_mtimes
+        if mtime == known:
+            current[level] = mtime
+        elif level == 0 and known not in (None, False) and mtime is not None and saved is not None:
+            if known <= mtime <= saved:
+                current[level] = mtime
+    return current
+
+
+def stale_levels(manifest, tile_dir=None):
+    """Levels whose directory changed since the manifest listed it."""
+    current = current_dir_mtimes(manifest, tile_dir)
+    return [level for level in range(PYRAMID_LEVELS + 1) if level not in current]
+
+
+def scan_level(level_dir, unmatched):
+    """List one level directory into {z: {"x_y": [size, mtime_ns]}}, appending names that do not parse to unmatched."""
+    planes = {}
+    with os.scandir(level_dir) as entries:
+        for entry in entries:
+            if not entry.name.lower().endswith(".png") or not entry.is_file():
+                continue
+            match = TILE_NAME_PATTERN.match(entry.name)
+            if match is None:
+                unmatched.append(entry.name)
+                continue
+            z, x, y = match.groups()
+            stat = entry.stat()
+            planes.setdefault(str(int(z)), {})[f"{int(x)}_{int(y)}"] = [stat.st_size, stat.st_mtime_ns]
+    return planes
+
+
+def update_manifest_bounds(manifest):
+    """Recompute the overall and per-plane bounds from the level 0 tiles."""
+    manifest["generated"] = time.time()
+    manifest["planes"] = {}
+    bounds = {}
+
+    for z, tiles in manifest["levels"].get("0", {}).items():
+        if not tiles:
+            continue
+        xs, ys = zip(*(tuple(int(part) for part in xy.split("_")) for xy in tiles))
+        plane = {"count": len(tiles), "x_min": min(xs), "x_max": max(xs), "y_min": min(ys), "y_max": max(ys)}
+        manifest["planes"][z] = plane
+
+        bounds["z_min"] = min(bounds.get("z_min", int(z)), int(z))
+        bounds["z_max"] = max(bounds.get("z_max", int(z)), int(z))
+        for name, pick in (("x_min", min), ("x_max", max), ("y_min", min), ("y_max", max)):
+            bounds[name] = pick(bounds.get(name, plane[name]), plane[name])
+
+    manifest["bounds"] = bounds
+
+
+def save_json(path, data):
+    # Write beside the old file and swap it in, so a reader never sees half a file
+    with open(path + ".tmp", "w") as f:
+        json.dump(data, f)
+    os.replace(path + ".tmp", path)
+
+
+def save_manifest(manifest, tile_dir=None):
+    save_json(manifest_path(tile_dir), manifest)
+
+
+def save_loaded_manifest(manifest, tile_dir=None):
+    """Save a manifest a reader listed, only warning if the tile directory is read-only."""
+    try:
+        save_manifest(manifest, tile_dir)
+    except OSError as e:
+        print(f"Could not save the tile manifest {manifest_path(tile_dir)}, using it from memory: {e}")
+
+
+def load_manifest(tile_dir=None, refresh=False, check=True):
+    """Read the tile manifest, scanning the directory and saving a new one if it is missing, and re-listing
+    the levels whose directory changed since unless check is off. A read-only directory's manifest is only
+    kept in memory."""
+    tile_dir = tile_dir or MAP_TILE_DIR
+    path = manifest_path(tile_dir)
+    if not refresh and os.path.exists(path):
         try:
-            parts = filename.lower().split('_')
-            z, x_str, y_str_with_ext = parts[0], parts[1], parts[2]
-            y_str = y_str_with_ext.split('.')[0]
-
-            x, y = int(x_str), int(y_str)
-
-            # Update bounds
-            min_x = min(min_x, x)
-            max_x = max(max_x, x)
-            min_y = min(min_y, y)
-            max_y = max(max_y, y)
-            total_files += 1
-        except ValueError as e:
-            print(f"Skipping invalid filename {filename}: {e}")
+            with open(path) as f:
+                manifest = json.load(f)
+            if manifest.get("version") == MANIFEST_VERSION:
+                stale = stale_levels(manifest, tile_dir) if check else []
+                if stale:
+                    rescan_levels(manifest, stale, tile_dir)
+                    save_loaded_manifest(manifest, tile_dir)
+                return manifest
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable manifest {path}: {e}")
+
+    manifest = scan_manifest(tile_dir)
+    save_loaded_manifest(manifest, tile_dir)
+    return manifest
+
+
+def manifest_tiles(manifest, level=0):
+    """Yield (z, x, y) for every tile of a level listed in the manifest."""
+    for z, tiles in manifest["levels"].get(str(level), {}).items():
+        for xy in tiles:
+            x, y = xy.split("_")
+            yield int(z), int(x), int(y)
+
+
+def manifest_files(manifest, level=0, tile_dir=None):
+    """Yield (path, size, mtime_ns) for every tile of a level listed in the manifest."""
+    tile_dir = tile_dir or MAP_TILE_DIR
+    level_dir = pyramid_level_dir(level, tile_dir)
+    for z, tiles in manifest["levels"].get(str(level), {}).items():
+        for xy, (size, mtime) in tiles.items():
+            yield os.path.join(level_dir, f"{z}_{xy}.png"), size, mtime
+
+
+def update_manifest(added=(), removed=(), level=0, tile_dir=None):
+    """Record added or removed tile files in the saved manifest without re-listing the directory.
+
+    The caller's changes are what moved the level directory's mtime, so it is recorded as listed.
+    """
+    tile_dir = tile_dir or MAP_TILE_DIR
+    manifest = load_manifest(tile_dir, check=False)
+    planes = manifest["levels"].setdefault(str(level), {})
+
+    for path in removed:
+        match = TILE_NAME_PATTERN.match(os.path.basename(path))
+        if match is not None:
+            z, x, y = (int(part) for part in match.groups())
+            planes.get(str(z), {}).pop(f"{x}_{y}", None)
+        elif os.path.basename(path) in manifest["unmatched"]:
+            manifest["unmatched"].remove(os.path.basename(path))
+
+    for path in added:
+        match = TILE_NAME_PATTERN.match(os.path.basename(path))
+        if match is None:
             continue
+        z, x, y = (int(part) for part in match.groups())
+        stat = os.stat(path)
+        planes.setdefault(str(z), {})[f"{x}_{y}"] = [stat.st_size, stat.st_mtime_ns]
+
+    manifest.setdefault("dir_mtimes", {})[str(level)] = dir_mtime(pyramid_level_dir(level, tile_dir))
+    update_manifest_bounds(manifest)
+    save_manifest(manifest, tile_dir)
+    return manifest
+
+
+def mark_tile_dir_listed(tile_dir=None):
+    """Record the base directory's mtime in the saved manifest after writing something other than tiles
+    into it, so the next load_manifest does not list the directory again for it."""
+    update_manifest(tile_dir=tile_dir)
+
+
+def refresh_manifest():
+    """Rescan the tile directory and rewrite the manifest."""
+    manifest = load_manifest(refresh=True)
+
+    print(f"\n--- Tile Manifest ---")
+    for level, planes in sorted(manifest["levels"].items(), key=lambda item: int(item[0])):
+        counts = ", ".join(f"z{z}: {len(tiles)}" for z, tiles in sorted(planes.items()))
+        print(f"Level {level}: {counts or 'no tiles'}")
+    print(f"Unmatched names: {len(manifest['unmatched'])}")
+    print(f"Saved to: {manifest_path()}")
+
+
+def scan_pool():
+    """Process pool for the per-tile scans, spawned so workers start without the parent's pygame state."""
+    os.environ["PYGAME_HIDE_SUPPORT_PROMPT"] = "1"  # one greeting is enough, not one per worker
+    return multiprocessing.get_context("spawn").Pool(SCAN_WORKERS)
+
+
+# === Map Bounds Function ===
+def get_bounds():
+    print_bounds(load_manifest())
+
+
+def print_bounds(manifest):
+    bounds = manifest["bounds"]
+    total_files = sum(plane["count"] for plane in manifest["planes"].values())
 
     if total_files == 0:
         print("No valid tile files found.")
     else:
         print(f"--- Map Bounds ---")
         print(f"Total tiles scanned: {total_files}")
-        print(f"X: {min_x} - {max_x}")
-        print(f"Y: {min_y} - {max_y}")
+        print(f"Z: {bounds['z_min']} - {bounds['z_max']}")
+        print(f"X: {bounds['x_min']} - {bounds['x_max']}")
+        print(f"Y: {bounds['y_min']} - {bounds['y_max']}")
+        for z, plane in sorted(manifest["planes"].items(), key=lambda item: int(item[0])):
+            print(f"  Plane {z}: {plane['count']} tiles, "
+                  f"X {plane['x_min']} - {plane['x_max']}, Y {plane['y_min']} - {plane['y_max']}")
 
 
 # === Format Names Function ===
 def format_names():
     """Renames all images in the base directory to the format [z]_[x]_[y].png, removing extra text."""
-    # Loop through all files in the base directory
-    for filename in os.listdir(MAP_TILE_DIR):
-        if filename.lower().endswith(".png"):  # Only process .png files
-            # Regular expression to capture the correct format [z]_[x]_[y] and remove anything after
-            # We need to match the whole pattern [z]_[x]_[y] and eliminate the extra text after it
-            new_filename = re.sub(r"^(\d+_\d+_\d+)[^\.]*\.png$", r"\1.png", filename)
-
-            # If the filename has changed, rename the file
-            if new_filename != filename:
-                old_path = os.path.join(MAP_TILE_DIR, filename)
-                new_path = os.path.join(MAP_TILE_DIR, new_filename)
+    manifest = load_manifest()
+    renamed = []
+
+    # Only names the manifest could not parse need fixing
+    for filename in list(manifest["unmatched"]):
+        new_filename = normalized_name(filename)
+
+        # If the filename has changed, rename the file
+        if new_filename != filename:
+            old_path = os.path.join(MAP_TILE_DIR, filename)
+            new_path = os.path.join(MAP_TILE_DIR, new_filename)
+
+            try:
+                os.rename(old_path, new_path)
+                print(f"Renamed {filename} to {new_filename}")
+                renamed.append((old_path, new_path))
+            except Exception as e:
+                print(f"Failed to rename {filename} to {new_filename}: {e}")
+
+    if renamed:
+        old_paths, new_paths = zip(*renamed)
+        update_manifest(added=new_paths, removed=old_paths)
 
-                try:
-                    os.rename(old_path, new_path)
-                    print(f"Renamed {filename} to {new_filename}")
-                except Exception as e:
-                    print(f"Failed to rename {filename} to {new_filename}: {e}")
+
+def normalized_name(filename):
+    """The z_x_y.png name for a tile file name with extra text after the coordinates."""
+    # Regular expression to capture the correct format [z]_[x]_[y] and remove anything after
+    # We need to match the whole pattern [z]_[x]_[y] and eliminate the extra text after it
+    return re.sub(r"^(\d+_\d+_\d+)[^\.]*\.png$", r"\1.png", filename)
 
 
 # === Find Monochrome Function ===
@@ -82,44 +365,61 @@ def is_uniform_color(image):
     return (r, g, b)  # Return the uniform color as an RGB tuple
 
 
+def uniform_color_of(path):
+    """Worker: return (path, uniform RGB colour or None, load error or None) for one tile."""
+    try:
+        image = pygame.image.load(path)
+    except Exception as e:
+        return path, None, str(e)
+
+    if np is None:
+        return path, is_uniform_color(image), None
+
+    # Compare every pixel against the first one in a single array operation
+    pixels = pygame.surfarray.array3d(image)  # width x height x RGB
+    first = pixels[0, 0]
+    if (pixels == first).all():
+        return path, tuple(int(c) for c in first), None
+    return path, None, None
+
+
 def find_monochrome():
     """Find and report all uniformly colored images in the base directory."""
-    os.environ["SDL_AUDIODRIVER"] = "dummy"  # set a dummy audio output to avoid error in pygame
-    pygame.init()
-    pygame.display.set_mode((1, 1))  # Dummy display required for surface creation
-
     color_counts = Counter()
     color_images = {}  # Dictionary to store color -> list of image paths
     total_images = 0
 
     print("\nFinding monochrome tiles...\n")
 
-    # Loop through each file in the base directory
-    for filename in os.listdir(MAP_TILE_DIR):
-        if not filename.lower().endswith(".png"):
-            continue  # Only process .png files
-
-        path = os.path.join(MAP_TILE_DIR, filename)
+    # Only decode tiles small enough on disk to possibly be one colour
+    candidates = []
+    for path, size, _ in manifest_files(load_manifest()):
         total_images += 1
-        try:
-            image = pygame.image.load(path).convert()  # Convert for faster access
-        except Exception as e:
-            print(f"Failed to load {path}: {e}")
-            continue
+        if MONOCHROME_MAX_FILE_BYTES is None or size <= MONOCHROME_MAX_FILE_BYTES:
+            candidates.append(path)
+    print(f"Decoding {len(candidates)} of {total_images} tiles on {SCAN_WORKERS} workers...")
 
-        # Check if the image is uniformly one color
-        color = is_uniform_color(image)
-        if color is not None:
-            color_counts[color] += 1  # Increment the count for this color
-            if color not in color_images:
-                color_images[color] = []
-            color_images[color].append(path)  # Store the image path for this color
+    with scan_pool() as pool:
+        for path, color, error in pool.imap_unordered(uniform_color_of, candidates, chunksize=64):
+            if error is not None:
+                print(f"Failed to load {path}: {error}")
+                continue
 
-    pygame.quit()
+            # Check if the image is uniformly one color
+            if color is not None:
+                color_counts[color] += 1  # Increment the count for this color
+                if color not in color_images:
+                    color_images[color] = []
+                color_images[color].append(path)  # Store the image path for this color
 
     # Output the results
     print(f"--- Uniform Color Images Report ---")
     print(f"Total images checked: {total_images}")
+    report_uniform_colors(color_counts, color_images)
+
+
+def report_uniform_colors(color_counts, color_images):
+    """List the uniform colours by count and let the user move the tiles of chosen colours."""
     if color_counts:
         color_list = list(color_counts.items())
         color_list.sort(key=lambda c: c[1], reverse=True)
@@ -170,6 +470,7 @@ def move_images(color_list, color_images):
                 dest_path = os.path.join(color_folder_path, os.path.basename(img_path))
                 shutil.move(img_path, dest_path)
                 print(f"Moved {os.path.basename(img_path)} to {color_folder_path}")
+            update_manifest(removed=images_to_move)
 
             # Remove the moved images from the color_images dictionary
             color_images.pop(color, None)
@@ -194,56 +495,778 @@ def move_images(color_list, color_images):
 
 
 # === Remove Corrupt Function ===
-def remove_corrupt():
-    """Move corrupt or unreadable images to a separate folder by rendering them as black squares."""
-    os.environ["SDL_AUDIODRIVER"] = "dummy"  # set a dummy audio output to avoid error in pygame
-    pygame.init()
-    pygame.display.set_mode((1, 1))  # Dummy display required for surface creation
+def check_png_structure(data):
+    """Check PNG signature, chunk CRCs and IDAT completeness without decoding pixels.
+
+    Returns (verdict, reason): "ok", "corrupt", or "suspicious" when only a full decode can tell.
+    """
+    if not data.startswith(PNG_SIGNATURE):
+        return "corrupt", "bad PNG signature"
+
+    pos = len(PNG_SIGNATURE)
+    header = None
+    idat = []
+    idat_closed = False
+    while True:
+        if pos + 8 > len(data):
+            return "corrupt", "truncated before IEND"
+        length, chunk_type = struct.unpack_from(">I4s", data, pos)
+        end = pos + 8 + length + 4
+        if end > len(data):
+            return "corrupt", f"truncated {chunk_type.decode('latin-1')} chunk"
+        chunk = data[pos + 4:pos + 8 + length]  # type and data, which the CRC covers
+        (crc,) = struct.unpack_from(">I", data, pos + 8 + length)
+        if zlib.crc32(chunk) != crc:
+            return "corrupt", f"CRC mismatch in {chunk_type.decode('latin-1')} chunk"
 
-    MONOCHROME_DIR = os.path.join(MAP_TILE_DIR, "corrupt_pngs")
+        if header is None and chunk_type != b"IHDR":
+            return "corrupt", "first chunk is not IHDR"
+        if chunk_type == b"IHDR":
+            if length != 13:
+                return "corrupt", "bad IHDR length"
+            header = struct.unpack(">IIBBBBB", chunk[4:])
+        elif chunk_type == b"IDAT":
+            if idat_closed:
+                return "corrupt", "IDAT chunks are not consecutive"
+            idat.append(chunk[4:])
+        elif idat:
+            idat_closed = True
+        pos = end
+        if chunk_type == b"IEND":
+            break
+
+    if not idat:
+        return "corrupt", "no IDAT chunk"
+    if pos != len(data):
+        return "suspicious", "data after IEND"
+
+    width, height, bit_depth, colour_type, _, _, interlace = header
+    if colour_type not in PNG_CHANNELS or interlace != 0:
+        return "suspicious", "interlaced or unusual colour type"
+
+    # The image data must inflate completely to exactly one filter byte plus one row per line
+    inflater = zlib.decompressobj()
+    try:
+        size = len(inflater.decompress(b"".join(idat)))
+    except zlib.error as e:
+        return "corrupt", f"IDAT does not inflate: {e}"
+    if not inflater.eof:
+        return "corrupt", "IDAT stream is incomplete"
+    row_bytes = (width * PNG_CHANNELS[colour_type] * bit_depth + 7) // 8
+    if size != height * (row_bytes + 1):
+        return "corrupt", f"IDAT holds {size} bytes, expected {height * (row_bytes + 1)}"
+    return "ok", None
+
+
+def validate_tile(path):
+    """Worker: return (path, True if the tile is readable, reason it is not)."""
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError as e:
+        return path, False, str(e)
+
+    verdict, reason = check_png_structure(data)
+    if verdict != "suspicious":
+        return path, verdict == "ok", reason
+
+    # Only a full decode can settle it
+    try:
+        pygame.image.load(path)
+    except Exception as e:
+        return path, False, str(e)
+    return path, True, None
+
+
+def validation_state_path():
+    return os.path.join(MAP_TILE_DIR, VALIDATION_STATE_NAME)
+
+
+def load_validation_state():
+    """Read the names, sizes and mtimes of the tiles that passed validation before."""
+    try:
+        with open(validation_state_path()) as f:
+            state = json.load(f)
+        if state.get("version") == VALIDATION_STATE_VERSION:
+            return state
+    except (OSError, ValueError):
+        pass
+    return {"version": VALIDATION_STATE_VERSION, "tiles": {}}
+
+
+def corrupt_dir():
+    return os.path.join(MAP_TILE_DIR, "corrupt_pngs")
+
+
+def move_corrupt(img_path):
+    """Move a corrupt image into the corrupt_pngs folder, numbering it if the name is taken."""
+    MONOCHROME_DIR = corrupt_dir()
     os.makedirs(MONOCHROME_DIR, exist_ok=True)
 
+    filename = os.path.basename(img_path)
+    dest_path = os.path.join(MONOCHROME_DIR, filename)
+    if os.path.exists(dest_path):
+        base, ext = os.path.splitext(filename)
+        count = 1
+        while os.path.exists(dest_path):
+            dest_path = os.path.join(MONOCHROME_DIR, f"{base}_{count}{ext}")
+            count += 1
+    shutil.move(img_path, dest_path)
+
+
+def remove_corrupt():
+    """Move corrupt or unreadable images to a separate folder, only checking tiles new or changed since the last scan."""
     total_images = 0
     moved_images = 0
+    moved_paths = []
+
+    # Tiles whose name, size and mtime match a previous pass are not checked again
+    state = load_validation_state()
 
-    # Loop through each file in the base directory
-    for filename in os.listdir(MAP_TILE_DIR):
-        if not filename.lower().endswith(".png"):
-            continue  # Only process .png files
+    # One fresh listing gives the sizes and mtimes on disk and refreshes the manifest too
+    manifest = load_manifest(check=False)
+    rescan_levels(manifest, [0])
+    save_manifest(manifest)
 
-        img_path = os.path.join(MAP_TILE_DIR, filename)
+    to_check = {}  # path -> [size, mtime_ns]
+    for img_path, size, mtime in manifest_files(manifest):
         total_images += 1
+        if state["tiles"].get(os.path.basename(img_path)) != [size, mtime]:
+            to_check[img_path] = [size, mtime]
+    print(f"\nChecking {len(to_check)} new or changed of {total_images} tiles on {SCAN_WORKERS} workers...")
 
-        try:
-            # Try to load the image
-            surface = pygame.image.load(img_path)
-            if surface.get_alpha() is not None:
-                image = surface.convert_alpha()  # Handle images with transparency
-            else:
-                image = surface.convert()  # Handle regular images without transparency
-        except Exception as e:
-            print(f"Error loading {img_path}: {e}")
-            
-            # If there is an error loading the image, create a black placeholder image
-            image = pygame.Surface((TILE_SIZE, TILE_SIZE)).convert()
-            image.fill((0, 0, 0))  # Fill it with black color (corrupt image placeholder)
+    results = []
+    if to_check:
+        with scan_pool() as pool:
+            results = list(pool.imap_unordered(validate_tile, list(to_check), chunksize=64))
+
+    for img_path, readable, reason in results:
+        filename = os.path.basename(img_path)
+        if readable:
+            state["tiles"][filename] = to_check[img_path]
+        else:
+            print(f"Error loading {img_path}: {reason}")
+            state["tiles"].pop(filename, None)
 
             # Move the corrupt image to the 'corrupt_pngs' folder
-            dest_path = os.path.join(MONOCHROME_DIR, filename)
-            if os.path.exists(dest_path):
-                base, ext = os.path.splitext(filename)
-                count = 1
-                while os.path.exists(dest_path):
-                    dest_path = os.path.join(MONOCHROME_DIR, f"{base}_{count}{ext}")
-                    count += 1
-            shutil.move(img_path, dest_path)
+            move_corrupt(img_path)
             moved_images += 1
+            moved_paths.append(img_path)
 
-    pygame.quit()
+    # The manifest goes last, so the mtime it records is the base directory's after the state was written
+    save_json(validation_state_path(), state)
+    update_manifest(removed=moved_paths)
 
     print(f"\n--- Corrupt Image Report ---")
     print(f"Total files scanned: {total_images}")
-    print(f"Moved {moved_images} corrupt or unreadable images to: {MONOCHROME_DIR}")
+    print(f"Checked as new or changed: {len(to_check)}")
+    print(f"Moved {moved_images} corrupt or unreadable images to: {corrupt_dir()}")
+
+
+# === Build Zoom Pyramid Function ===
+def merge_children(children):
+    """Merge (x, y, surface) tiles of a level into their parent tile of the level above.
+
+    Merges at full resolution, then downsamples once. Missing children are left black.
+    """
+    merged = pygame.Surface((TILE_SIZE * 2, TILE_SIZE * 2))
+    merged.fill((0, 0, 0))
+    for x, y, child in children:
+        # Y grows northwards, so the upper half of the merged tile holds the odd rows
+        merged.blit(child, ((x % 2) * TILE_SIZE, (1 - y % 2) * TILE_SIZE))
+    return pygame.transform.smoothscale(merged, (TILE_SIZE, TILE_SIZE))
+
+
+def build_pyramid():
+    """Build downsampled tile levels, each level merging 2x2 tiles of the level below into one tile."""
+    os.environ["SDL_AUDIODRIVER"] = "dummy"  # set a dummy audio output to avoid error in pygame
+    pygame.init()
+    pygame.display.set_mode((1, 1))  # Dummy display required for surface creation
+
+    print("\nBuilding zoom pyramid...\n")
+    manifest = load_manifest()
+
+    for level in range(1, PYRAMID_LEVELS + 1):
+        source_dir = pyramid_level_dir(level - 1)
+        target_dir = pyramid_level_dir(level)
+        os.makedirs(target_dir, exist_ok=True)
+
+        # Group the source tiles by the tile they merge into, on every plane
+        parents = {}  # (z, x, y) -> list of (x, y) source tiles
+        for z, x, y in manifest_tiles(manifest, level - 1):
+            parents.setdefault((z, x // 2, y // 2), []).append((x, y))
+
+        written = []
+        for (z, px, py), children in parents.items():
+            loaded = []
+            for x, y in children:
+                path = os.path.join(source_dir, f"{z}_{x}_{y}.png")
+                try:
+                    loaded.append((x, y, pygame.image.load(path)))
+                except Exception as e:
+                    print(f"Failed to load {path}: {e}")
+
+            tile = merge_children(loaded)
+            tile_path = os.path.join(target_dir, f"{z}_{px}_{py}.png")
+            pygame.image.save(tile, tile_path)
+            written.append(tile_path)
+
+        manifest = update_manifest(added=written, level=level)
+        print(f"Level {level}: wrote {len(written)} tiles to {target_dir}")
+
+    mark_tile_dir_listed()  # creating the pyramid directory moved the base directory's mtime
+    pygame.quit()
+
+    print(f"\n--- Zoom Pyramid Report ---")
+    print(f"Built {PYRAMID_LEVELS} levels in: {os.path.join(MAP_TILE_DIR, PYRAMID_DIR_NAME)}")
+
+
+# === Dedup Index Function ===
+# Layout of dedup.json:
+#   "levels": {level: {z: {"x_y": [pixel hash, size, mtime_ns]}}}, matching the manifest layout
+def dedup_index_path(tile_dir=None):
+    tile_dir = tile_dir or MAP_TILE_DIR
+    return os.path.join(tile_dir, DEDUP_INDEX_NAME)
+
+
+def load_dedup_index(tile_dir=None):
+    """Read the dedup index, or return None if it has not been built."""
+    path = dedup_index_path(tile_dir)
+    try:
+        with open(path) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if index.get("version") != DEDUP_INDEX_VERSION:
+        return None
+    return index
+
+
+def dedup_blobs(manifest, index):
+    """Map (z, x, y, level) to its pixel hash for every tile that shares its pixels with another tile.
+
+    Entries whose size or mtime no longer match the manifest are left out.
+    """
+    groups = {}
+    for level, planes in index["levels"].items():
+        listed = manifest["levels"].get(level, {})
+        for z, tiles in planes.items():
+            for xy, (digest, size, mtime) in tiles.items():
+                if listed.get(z, {}).get(xy) != [size, mtime]:
+                    continue
+                x, y = xy.split("_")
+                groups.setdefault(digest, []).append((int(z), int(x), int(y), int(level)))
+
+    return {key: digest for digest, keys in groups.items() if len(keys) > 1 for key in keys}
+
+
+def file_digest(path):
+    """Worker: return (path, hash of the file bytes or None, read error or None)."""
+    try:
+        with open(path, "rb") as f:
+            return path, hashlib.blake2b(f.read(), digest_size=16).hexdigest(), None
+    except OSError as e:
+        return path, None, str(e)
+
+
+def pixel_digest(path):
+    """Worker: return (path, hash of the decoded RGB pixels or None, load error or None)."""
+    try:
+        image = pygame.image.load(path)
+    except Exception as e:
+        return path, None, str(e)
+    return path, hash_pixels(image, pygame.image.tobytes(image, "RGB")), None
+
+
+def hash_pixels(image, pixels):
+    """Hash of a tile's size and RGB pixels, the same for identical tiles whatever their file bytes."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{image.get_width()}x{image.get_height()}".encode())
+    digest.update(pixels)
+    return digest.hexdigest()
+
+
+def build_dedup_index():
+    """Hash the pixels of every tile and pyramid tile so the viewer can share identical tiles."""
+    manifest = load_manifest()
+    previous = load_dedup_index() or {"levels": {}}
+    index = {"version": DEDUP_INDEX_VERSION, "levels": {}}
+
+    print("\nHashing tiles...\n")
+
+    # Keep hashes of tiles that have not changed since the last run
+    changed = {}  # path -> (level, z, "x_y", size, mtime)
+    for level, planes in manifest["levels"].items():
+        level_dir = pyramid_level_dir(int(level))
+        for z, tiles in planes.items():
+            for xy, (size, mtime) in tiles.items():
+                entry = previous["levels"].get(level, {}).get(z, {}).get(xy)
+                if entry is not None and entry[1:] == [size, mtime]:
+                    index["levels"].setdefault(level, {}).setdefault(z, {})[xy] = entry
+                else:
+                    changed[os.path.join(level_dir, f"{z}_{xy}.png")] = (level, z, xy, size, mtime)
+    print(f"{len(changed)} new or changed tiles to hash on {SCAN_WORKERS} workers...")
+
+    with scan_pool() as pool:
+        # Byte-identical files share pixels, so only one file per distinct byte hash is decoded
+        by_file_hash = {}  # file hash -> paths
+        for path, digest, error in pool.imap_unordered(file_digest, list(changed), chunksize=64):
+            if error is not None:
+                print(f"Failed to read {path}: {error}")
+                continue
+            by_file_hash.setdefault(digest, []).append(path)
+
+        representatives = {paths[0]: paths for paths in by_file_hash.values()}
+        for path, digest, error in pool.imap_unordered(pixel_digest, list(representatives), chunksize=64):
+            if error is not None:
+                print(f"Failed to load {path}: {error}")
+                continue
+            for same_path in representatives[path]:
+                level, z, xy, size, mtime = changed[same_path]
+                index["levels"].setdefault(level, {}).setdefault(z, {})[xy] = [digest, size, mtime]
+
+    path = dedup_index_path()
+    save_json(path, index)
+    mark_tile_dir_listed()
+
+    # Output the results
+    print(f"--- Dedup Index Report ---")
+    print_dedup_summary(index)
+    print(f"Saved to: {path}")
+
+
+def print_dedup_summary(index):
+    counts = Counter(entry[0] for planes in index["levels"].values()
+                     for tiles in planes.values() for entry in tiles.values())
+    total_tiles = sum(counts.values())
+    shared = sum(count for count in counts.values() if count > 1)
+    print(f"Total tiles hashed: {total_tiles}")
+    print(f"Distinct tiles: {len(counts)}")
+    if total_tiles:
+        print(f"Tiles sharing their pixels with another tile: {shared} ({shared / total_tiles:.1%})")
+    for digest, count in counts.most_common(5):
+        if count > 1:
+            print(f"  {digest}: {count} tiles")
+
+
+# === Tile Archive Functions ===
+def archive_path(tile_dir=None):
+    tile_dir = tile_dir or MAP_TILE_DIR
+    return os.path.join(tile_dir, ARCHIVE_NAME)
+
+
+class TileArchive:
+    """Read-only view of a packed tile archive, memory-mapped so payloads are never copied on read."""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.payload_format, self.tile_size, _, count, index_offset = \
+            ARCHIVE_HEADER.unpack_from(self.map, 0)
+        if magic != ARCHIVE_MAGIC or version != ARCHIVE_VERSION:
+            self.map.close()
+            raise ValueError(f"{path} is not a version {ARCHIVE_VERSION} tile archive")
+
+        self.index = {}  # (z, x, y, level) -> (offset, length)
+        index_bytes = self.map[index_offset:index_offset + count * ARCHIVE_ENTRY.size]
+        for z, level, x, y, offset, length in ARCHIVE_ENTRY.iter_unpack(index_bytes):
+            self.index[(z, x, y, level)] = (offset, length)
+
+    def keys(self):
+        return self.index.keys()
+
+    def payload(self, key):
+        """Decoded RGB pixels of a tile, a view straight into the map for raw archives."""
+        offset, length = self.index[key]
+        view = memoryview(self.map)[offset:offset + length]
+        if self.payload_format == ARCHIVE_ZLIB:
+            with view:
+                return memoryview(zlib.decompress(view))
+        return view
+
+    def close(self):
+        self.map.close()
+
+
+def archive_changes(archive, manifest, path):
+    """Return (added or rewritten, removed) tile counts of the manifest against an archive packed to path."""
+    packed = os.stat(path).st_mtime_ns
+    listed = set()
+    changed = 0
+    for level, planes in manifest["levels"].items():
+        for z, tiles in planes.items():
+            for xy, (_, mtime) in tiles.items():
+                x, y = xy.split("_")
+                key = (int(z), int(x), int(y), int(level))
+                listed.add(key)
+                if mtime > packed or key not in archive.index:
+                    changed += 1
+    removed = sum(1 for key in archive.index if key not in listed)
+    return changed, removed
+
+
+def pack_payload(task):
+    """Worker: decode a tile to raw RGB, compressed if asked, returning (key, payload or None, error or None)."""
+    key, path, compress = task
+    try:
+        image = pygame.image.load(path)
+    except Exception as e:
+        return key, None, str(e)
+    if image.get_size() != (TILE_SIZE, TILE_SIZE):
+        return key, None, f"expected a {TILE_SIZE}x{TILE_SIZE} tile, got {image.get_width()}x{image.get_height()}"
+
+    payload = pygame.image.tobytes(image, "RGB")
+    if compress:
+        payload = zlib.compress(payload, 6)
+    return key, payload, None
+
+
+def pack_archive():
+    """Pack every tile and pyramid tile into one archive file the viewer can memory-map."""
+    choice = input("\nPayload format: 1. Raw RGB (fastest, largest)  2. Compressed RGB: ").strip()
+    if choice not in ('1', '2'):
+        print("Invalid choice. Returning to main menu.")
+        return
+    payload_format = ARCHIVE_RAW if choice == '1' else ARCHIVE_ZLIB
+
+    manifest = load_manifest()
+    tasks = []
+    for level in range(PYRAMID_LEVELS + 1):
+        level_dir = pyramid_level_dir(level)
+        for z, x, y in manifest_tiles(manifest, level):
+            tasks.append(((z, x, y, level), os.path.join(level_dir, f"{z}_{x}_{y}.png"), payload_format == ARCHIVE_ZLIB))
+
+    print(f"\nPacking {len(tasks)} tiles on {SCAN_WORKERS} workers...\n")
+
+    path = archive_path()
+    entries = []
+    stored = {}  # payload hash -> (offset, length), identical payloads are stored once
+    with open(path + ".tmp", "wb") as f, scan_pool() as pool:
+        f.write(b"\0" * ARCHIVE_HEADER.size)  # header is written last, once the index offset is known
+        for key, payload, error in pool.imap_unordered(pack_payload, tasks, chunksize=16):
+            if error is not None:
+                print(f"Skipping {key}: {error}")
+                continue
+            digest = hashlib.blake2b(payload, digest_size=16).digest()
+            if digest not in stored:
+                stored[digest] = (f.tell(), len(payload))
+                f.write(payload)
+            entries.append((key, *stored[digest]))
+
+        index_offset = f.tell()
+        for (z, x, y, level), offset, length in sorted(entries):
+            f.write(ARCHIVE_ENTRY.pack(z, level, x, y, offset, length))
+
+        f.seek(0)
+        f.write(ARCHIVE_HEADER.pack(
+            ARCHIVE_MAGIC, ARCHIVE_VERSION, payload_format, TILE_SIZE, 0, len(entries), index_offset))
+    os.replace(path + ".tmp", path)
+    mark_tile_dir_listed()
+
+    print(f"--- Tile Archive Report ---")
+    print(f"Tiles packed: {len(entries)}")
+    print(f"Distinct payloads stored: {len(stored)}")
+    print(f"Archive size: {os.path.getsize(path) / (1024 * 1024):.1f} MiB")
+    print(f"Saved to: {path}")
+
+
+# === Stitched Map Export Function ===
+def adler32_combine(adler1, adler2, length2):
+    """Adler-32 of two byte strings joined, from their separate checksums (zlib's adler32_combine)."""
+    base = 65521
+    rem = length2 % base
+    sum1 = adler1 & 0xFFFF
+    sum2 = (rem * sum1) % base
+    sum1 += (adler2 & 0xFFFF) + base - 1
+    sum2 += (adler1 >> 16) + (adler2 >> 16) + base - rem
+    return (sum1 % base) | ((sum2 % base) << 16)
+
+
+def write_png_chunk(f, chunk_type, data):
+    f.write(struct.pack(">I", len(data)))
+    f.write(chunk_type)
+    f.write(data)
+    f.write(struct.pack(">I", zlib.crc32(chunk_type + data)))
+
+
+def export_band(task):
+    """Worker: stitch one row of tiles into PNG scanlines and deflate them.
+
+    The band is deflated as a raw block ending on a full flush, so the bands from all workers can be
+    joined into one zlib stream. Returns (band index, deflated bytes, Adler-32 and length of the
+    scanlines, tiles drawn, errors).
+    """
+    band, tiles, tile_px, compress_level = task
+    surface = pygame.Surface((len(tiles) * tile_px, tile_px))
+    surface.fill(EXPORT_BACKGROUND)
+
+    drawn = 0
+    errors = []
+    for i, path in enumerate(tiles):
+        if path is None:
+            continue
+        try:
+            image = pygame.image.load(path)
+        except Exception as e:
+            errors.append(f"{path}: {e}")
+            continue
+        if image.get_size() != (tile_px, tile_px):
+            image = pygame.transform.smoothscale(image, (tile_px, tile_px))
+        surface.blit(image, (i * tile_px, 0))
+        drawn += 1
+
+    # Every scanline starts with filter type 0, the pixels as they are
+    pixels = pygame.image.tobytes(surface, "RGB")
+    stride = surface.get_width() * 3
+    scanlines = b"".join(b"\0" + pixels[row * stride:(row + 1) * stride] for row in range(tile_px))
+
+    deflater = zlib.compressobj(compress_level, zlib.DEFLATED, -15)
+    data = deflater.compress(scanlines) + deflater.flush(zlib.Z_FULL_FLUSH)
+    return band, data, zlib.adler32(scanlines), len(scanlines), drawn, errors
+
+
+def export_map():
+    """Stitch the tiles of a plane inside a bounding box into one PNG, one row of tiles at a time.
+
+    Bands are stitched and deflated on the scan workers and written in order as they finish, with at
+    most EXPORT_BANDS_IN_FLIGHT bands per worker held in memory, so the output can be any size.
+    """
+    manifest = load_manifest()
+    planes = manifest["planes"]
+    if not planes:
+        print("No valid tile files found.")
+        return
+
+    print("\nPlanes:")
+    for z, plane in sorted(planes.items(), key=lambda item: int(item[0])):
+        print(f"  {z}: X {plane['x_min']} - {plane['x_max']}, Y {plane['y_min']} - {plane['y_max']}")
+
+    z = input("Plane to export: ").strip()
+    if z not in planes:
+        print("Invalid plane. Returning to main menu.")
+        return
+    plane = planes[z]
+
+    box = input("Tile bounds as 'x_min x_max y_min y_max' (Enter for the whole plane): ").split()
+    try:
+        if box:
+            x_min, x_max, y_min, y_max = (int(v) for v in box)
+        else:
+            x_min, x_max, y_min, y_max = plane["x_min"], plane["x_max"], plane["y_min"], plane["y_max"]
+        scale = float(input("Scale, 1 for full resolution (Enter for 1): ").strip() or 1)
+    except ValueError:
+        print("Invalid input. Returning to main menu.")
+        return
+    tile_px = round(TILE_SIZE * scale)
+    if x_min > x_max or y_min > y_max or tile_px < 1:
+        print("Invalid bounds or scale. Returning to main menu.")
+        return
+
+    width = (x_max - x_min + 1) * tile_px
+    height = (y_max - y_min + 1) * tile_px
+    if width >= 2 ** 31 or height >= 2 ** 31:
+        print("Too large for a PNG. Returning to main menu.")
+        return
+
+    export_dir = os.path.join(MAP_TILE_DIR, EXPORT_DIR_NAME)
+    os.makedirs(export_dir, exist_ok=True)
+    mark_tile_dir_listed()
+    path = os.path.join(export_dir, f"map_z{z}_x{x_min}-{x_max}_y{y_min}-{y_max}_{tile_px}px.png")
+
+    # Y grows northwards, so the top band is the highest row; missing tiles are left as background
+    present = manifest["levels"].get("0", {}).get(z, {})
+    bands = []
+    for y in range(y_max, y_min - 1, -1):
+        bands.append([os.path.join(MAP_TILE_DIR, f"{z}_{x}_{y}.png") if f"{x}_{y}" in present else None
+                      for x in range(x_min, x_max + 1)])
+
+    print(f"\nExporting {width}x{height} pixels in {len(bands)} bands on {SCAN_WORKERS} workers...\n")
+
+    drawn = 0
+    failed = 0
+    adler = 1  # Adler-32 of no data
+    in_flight = deque()
+    next_band = 0
+    with open(path + ".tmp", "wb") as f, scan_pool() as pool:
+        f.write(PNG_SIGNATURE)
+        write_png_chunk(f, b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        write_png_chunk(f, b"IDAT", b"\x78\x9c")  # zlib header, default compression
+
+        for band in range(len(bands)):
+            # Keep the workers busy, but never let finished bands pile up unwritten
+            while next_band < len(bands) and len(in_flight) < SCAN_WORKERS * EXPORT_BANDS_IN_FLIGHT:
+                task = (next_band, bands[next_band], tile_px, EXPORT_COMPRESS_LEVEL)
+                in_flight.append(pool.apply_async(export_band, (task,)))
+                next_band += 1
+
+            _, data, band_adler, length, band_drawn, errors = in_flight.popleft().get()
+            write_png_chunk(f, b"IDAT", data)
+            adler = adler32_combine(adler, band_adler, length)
+            drawn += band_drawn
+            failed += len(errors)
+            for error in errors:
+                print(f"Failed to load {error}")
+            if (band + 1) % max(1, len(bands) // 10) == 0:
+                print(f"Written {band + 1}/{len(bands)} bands")
+
+        # An empty final block closes the deflate stream, the Adler-32 trailer closes the zlib stream
+        trailer = zlib.compressobj(EXPORT_COMPRESS_LEVEL, zlib.DEFLATED, -15).flush()
+        write_png_chunk(f, b"IDAT", trailer + struct.pack(">I", adler))
+        write_png_chunk(f, b"IEND", b"")
+    os.replace(path + ".tmp", path)
+
+    print(f"--- Map Export Report ---")
+    print(f"Image size: {width}x{height}")
+    print(f"Tiles drawn: {drawn}")
+    print(f"Missing tiles: {sum(band.count(None) for band in bands)}")
+    print(f"Unreadable tiles: {failed}")
+    print(f"File size: {os.path.getsize(path) / (1024 * 1024):.1f} MiB")
+    print(f"Saved to: {path}")
+
+
+# === Full Scan Function ===
+# One listing of the tile directory feeds the workers as it goes, and each worker reads, validates,
+# decodes and hashes its tile once, instead of every command walking and decoding the set again.
+def scan_tile(path):
+    """Worker: return (path, reason it is unreadable or None, uniform RGB colour or None, pixel hash or None)."""
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError as e:
+        return path, str(e), None, None
+
+    verdict, reason = check_png_structure(data)
+    if verdict == "corrupt":
+        return path, reason, None, None
+
+    # The one decode settles suspicious files and provides the pixels for both checks below
+    try:
+        image = pygame.image.load(io.BytesIO(data), os.path.basename(path))
+    except Exception as e:
+        return path, str(e), None, None
+    pixels = pygame.image.tobytes(image, "RGB")
+
+    # A uniform tile is its first pixel repeated, a plain bytes comparison needs no numpy
+    first = pixels[:3]
+    color = tuple(first) if pixels == first * (len(pixels) // 3) else None
+    return path, None, color, hash_pixels(image, pixels)
+
+
+def stream_tiles(manifest, renamed, stats):
+    """List the base directory once, yielding each tile path as it is found.
+
+    Names with extra text after the coordinates are renamed to z_x_y.png once the listing is done, unless
+    that name is taken, and yielded then. Every tile is recorded in the level 0 planes of manifest, and its
+    [size, mtime_ns] in stats.
+    """
+    planes = manifest["levels"].setdefault("0", {})
+
+    def record(match, path, stat):
+        z, x, y = (int(part) for part in match.groups())
+        planes.setdefault(str(z), {})[f"{x}_{y}"] = stats[path] = [stat.st_size, stat.st_mtime_ns]
+
+    # Renaming while the listing is open can list the renamed file a second time, so renames wait for the end
+    to_rename = []
+    with os.scandir(MAP_TILE_DIR) as entries:
+        for entry in entries:
+            if not entry.name.lower().endswith(".png") or not entry.is_file():
+                continue
+            match = TILE_NAME_PATTERN.match(entry.name)
+            if match is None:
+                to_rename.append(entry.name)
+                continue
+            record(match, entry.path, entry.stat())
+            yield entry.path
+
+    for filename in to_rename:
+        new_filename = normalized_name(filename)
+        new_path = os.path.join(MAP_TILE_DIR, new_filename)
+        match = TILE_NAME_PATTERN.match(new_filename)
+        if match is None or os.path.exists(new_path):
+            manifest["unmatched"].append(filename)
+            continue
+        try:
+            os.rename(os.path.join(MAP_TILE_DIR, filename), new_path)
+        except OSError as e:
+            print(f"Failed to rename {filename} to {new_filename}: {e}")
+            manifest["unmatched"].append(filename)
+            continue
+        renamed.append((filename, new_filename))
+        record(match, new_path, os.stat(new_path))
+        yield new_path
+
+
+def full_scan():
+    """Rename, validate, bound, colour-check and hash every tile in one pass, then report and act on the results."""
+    manifest = {"version": MANIFEST_VERSION, "levels": {}, "unmatched": [], "dir_mtimes": {}}
+    renamed = []  # (old name, new name)
+    stats = {}  # path -> [size, mtime_ns]
+    corrupt = []
+    color_counts = Counter()
+    color_images = {}
+    hashes = {}  # path -> pixel hash
+
+    print(f"\nScanning tiles on {SCAN_WORKERS} workers...\n")
+
+    with scan_pool() as pool:
+        results = pool.imap_unordered(scan_tile, stream_tiles(manifest, renamed, stats), chunksize=16)
+        for path, error, color, digest in results:
+            if error is not None:
+                print(f"Error loading {path}: {error}")
+                corrupt.append(path)
+                continue
+            hashes[path] = digest
+            if color is not None:
+                color_counts[color] += 1
+                color_images.setdefault(color, []).append(path)
+
+    # Pyramid levels are derived data, they are listed as they are but not checked
+    rescan_levels(manifest, range(1, PYRAMID_LEVELS + 1))
+
+    # Corrupt tiles go straight to their folder, like Remove Corrupt Images does
+    planes = manifest["levels"]["0"]
+    for path in corrupt:
+        move_corrupt(path)
+        z, x, y = (int(part) for part in TILE_NAME_PATTERN.match(os.path.basename(path)).groups())
+        planes.get(str(z), {}).pop(f"{x}_{y}", None)
+    manifest["levels"]["0"] = {z: tiles for z, tiles in planes.items() if tiles}
+    update_manifest_bounds(manifest)
+
+    # Every remaining tile was just validated and hashed, so later runs of those commands can skip them
+    state = {"version": VALIDATION_STATE_VERSION, "tiles": {}}
+    previous = load_dedup_index() or {"levels": {}}
+    index = {"version": DEDUP_INDEX_VERSION, "levels": {level: planes for level, planes in previous["levels"].items()
+                                                        if level != "0"}}
+    for path, digest in hashes.items():
+        filename = os.path.basename(path)
+        z, x, y = (int(part) for part in TILE_NAME_PATTERN.match(filename).groups())
+        state["tiles"][filename] = stats[path]
+        index["levels"].setdefault("0", {}).setdefault(str(z), {})[f"{x}_{y}"] = [digest] + stats[path]
+    save_json(validation_state_path(), state)
+    save_json(dedup_index_path(), index)
+
+    # The renames, moves and files above are what changed the base directory since it was listed
+    manifest["dir_mtimes"]["0"] = dir_mtime(MAP_TILE_DIR)
+    save_manifest(manifest)
+
+    # Output the results
+    print(f"\n--- Full Scan Report ---")
+    print(f"Tiles found: {len(stats)}")
+    print(f"Renamed to z_x_y.png: {len(renamed)}")
+    for old_name, new_name in renamed[:5]:
+        print(f"  {old_name} -> {new_name}")
+    if manifest["unmatched"]:
+        print(f"Names left unmatched: {len(manifest['unmatched'])}")
+    print(f"Moved {len(corrupt)} corrupt or unreadable images to: {corrupt_dir()}")
+    print()
+    print_bounds(manifest)
+    print()
+    print_dedup_summary({"levels": {"0": index["levels"].get("0", {})}})
+    print()
+    print(f"--- Uniform Color Images Report ---")
+    print(f"Uniformly colored tiles: {sum(color_counts.values())}")
+    report_uniform_colors(color_counts, color_images)
 
 
 # === Main Menu ===
@@ -253,8 +1276,14 @@ def main():
         print("1. Map Bounds")
         print("2. Find Monochrome Images")
         print("3. Remove Corrupt Images")
-        print("4. Format Image Names")  # Add the new option here
-        print("5. Exit")
+        print("4. Format Image Names")
+        print("5. Build Zoom Pyramid")
+        print("6. Refresh Tile Manifest")
+        print("7. Build Dedup Index")
+        print("8. Pack Tile Archive")
+        print("9. Export Stitched Map")
+        print("10. Full Scan")
+        print("11. Exit")
 
         choice = input("Enter your choice: ").strip()
 
@@ -267,6 +1296,18 @@ def main():
         elif choice == '4':  # Option to run the format_names function
             format_names()
         elif choice == '5':
+            build_pyramid()
+        elif choice == '6':
+            refresh_manifest()
+        elif choice == '7':
+            build_dedup_index()
+        elif choice == '8':
+            pack_archive()
+        elif choice == '9':
+            export_map()
+        elif choice == '10':
+            full_scan()
+        elif choice == '11':
             print("Exiting...")
             break
         else:
@@ -0,0 +1,279 @@
+"""Local tile server.
+
+Serves the rip's tiles over HTTP, so several viewers share one server that reads and encodes each
+tile once instead of every viewer decoding the shared mount on its own:
+
+    python tile_server.py --tile-dir /path/to/rip --port 8765
+
+GET /{z}/{x}/{y} returns the PNG of a tile and /{z}/{x}/{y}?level=N the tile N pyramid levels up,
+taken from the pyramid directory or the tile archive when they have it and downscaled from the level
+below otherwise. GET /manifest.json lists every tile the server can return, pyramid levels included.
+Responses carry an ETag, and a request whose If-None-Match matches it gets a 304 with no body.
+"""
+import argparse
+import asyncio
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+import urllib.parse
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ["PYGAME_HIDE_SUPPORT_PROMPT"] = "1"
+
+import pygame
+
+import map_tools
+
+# === Constants ===
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8765
+SERVER_CACHE_MAX_BYTES = 256 * 1024 * 1024  # encoded responses kept in memory
+SERVER_WORKERS = 4  # threads reading and encoding tiles, the event loop itself never blocks on them
+SERVER_MAX_HEADER_LINES = 100
+
+
+# === Tile Store ===
+class TileStore:
+    """Encoded PNG responses for the tiles of one tile directory, least recently used dropped first.
+
+    Safe to call from several threads, the encoding itself runs outside the lock.
+    """
+
+    def __init__(self, tile_dir, max_bytes=SERVER_CACHE_MAX_BYTES):
+        self.tile_dir = tile_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.responses = OrderedDict()  # key or "manifest" -> (body, etag)
+        self.bytes = 0
+
+        # Statistics
+        self.hits = 0
+        self.misses = 0
+
+        manifest = map_tools.load_manifest(tile_dir)
+        self.files = {}  # (z, x, y, level) -> path of the PNG on disk
+        for level in range(map_tools.PYRAMID_LEVELS + 1):
+            level_dir = map_tools.pyramid_level_dir(level, tile_dir)
+            for z, x, y in map_tools.manifest_tiles(manifest, level):
+                self.files[(z, x, y, level)] = os.path.join(level_dir, f"{z}_{x}_{y}.png")
+
+        self.archive = None
+        path = map_tools.archive_path(tile_dir)
+        if os.path.exists(path):
+            try:
+                self.archive = map_tools.TileArchive(path)
+                changed, removed = map_tools.archive_changes(self.archive, manifest, path)
+                if changed or removed:
+                    print(f"Not using tile archive {path}: {changed} tiles added or changed and {removed} "
+                          f"removed since it was packed")
+                    self.archive.close()
+                    self.archive = None
+            except (OSError, ValueError) as e:
+                print(f"Not using tile archive {path}: {e}")
+
+        # Every level the viewer may ask for, parents of existing tiles being built on request
+        self.keys = set(self.files)
+        if self.archive is not None:
+            self.keys.update(self.archive.keys())
+        for level in range(1, map_tools.PYRAMID_LEVELS + 1):
+            self.keys.update((z, x // 2, y // 2, level) for z, x, y, below in list(self.keys) if below == level - 1)
+
+    def manifest(self):
+        """The tile manifest for viewers, listing every key the server can return."""
+        manifest = {"version": map_tools.MANIFEST_VERSION, "levels": {}, "unmatched": []}
+        for z, x, y, level in self.keys:
+            manifest["levels"].setdefault(str(level), {}).setdefault(str(z), {})[f"{x}_{y}"] = [0, 0]
+        map_tools.update_manifest_bounds(manifest)
+        return manifest
+
+    def response(self, key):
+        """Return (body, etag) for a tile key or "manifest", or None if there is no such tile."""
+        with self.lock:
+            cached = self.responses.get(key)
+            if cached is not None:
+                self.responses.move_to_end(key)
+                self.hits += 1
+                return cached
+            self.misses += 1
+
+        if key == "manifest":
+            body = json.dumps(self.manifest()).encode()
+        elif key not in self.keys:
+            return None
+        else:
+            body = self.encode(key)
+        cached = (body, f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"')
+
+        with self.lock:
+            if key not in self.responses:
+                self.responses[key] = cached
+                self.bytes += len(body)
+                while self.bytes > self.max_bytes and len(self.responses) > 1:
+                    _, (dropped, _) = self.responses.popitem(last=False)
+                    self.bytes -= len(dropped)
+        return cached
+
+    def encode(self, key):
+        """PNG bytes of a tile, straight from disk when a file exists."""
+        path = self.files.get(key)
+        if path is not None:
+            with open(path, "rb") as f:
+                return f.read()
+        buffer = io.BytesIO()
+        pygame.image.save(self.surface(key), buffer, "tile.png")
+        return buffer.getvalue()
+
+    def surface(self, key):
+        """Decoded tile, read from the archive or merged from the 2x2 tiles of the level below."""
+        if self.archive is not None and key in self.archive.index:
+            size = self.archive.tile_size
+            with self.archive.payload(key) as payload:
+                return pygame.image.frombuffer(payload, (size, size), "RGB").copy()
+
+        z, x, y, level = key
+        if level == 0:
+            return pygame.image.load(self.files[key])
+
+        # Children go through response() so they are cached for their own requests too
+        children = []
+        for cx in (x * 2, x * 2 + 1):
+            for cy in (y * 2, y * 2 + 1):
+                child = (z, cx, cy, level - 1)
+                if child in self.keys:
+                    body, _ = self.response(child)
+                    children.append((cx, cy, pygame.image.load(io.BytesIO(body), "tile.png")))
+        return map_tools.merge_children(children)
+
+    def stats(self):
+        with self.lock:
+            return {"responses": len(self.responses), "bytes": self.bytes, "hits": self.hits, "misses": self.misses}
+
+
+# === HTTP Handling ===
+def parse_tile_path(target):
+    """Map a request target to a tile key or "manifest", or None if it is not one the server knows."""
+    url = urllib.parse.urlsplit(target)
+    if url.path == "/manifest.json":
+        return "manifest"
+
+    parts = url.path.strip("/").split("/")
+    if len(parts) != 3:
+        return None
+    if parts[2].endswith(".png"):
+        parts[2] = parts[2][:-len(".png")]
+    query = urllib.parse.parse_qs(url.query)
+    try:
+        z, x, y = (int(part) for part in parts)
+        level = int(query.get("level", ["0"])[0])
+    except ValueError:
+        return None
+    if not 0 <= level <= map_tools.PYRAMID_LEVELS:
+        return None
+    return z, x, y, level
+
+
+async def respond(method, target, headers, store, executor):
+    """Return (status, reason, extra headers, body) for one request."""
+    if method not in ("GET", "HEAD"):
+        return 405, "Method Not Allowed", {"Allow": "GET, HEAD"}, b""
+    key = parse_tile_path(target)
+    if key is None:
+        return 404, "Not Found", {}, b""
+
+    loop = asyncio.get_running_loop()
+    try:
+        cached = await loop.run_in_executor(executor, store.response, key)
+    except Exception as e:
+        print(f"Error serving {target}: {e}")
+        return 500, "Internal Server Error", {}, b""
+    if cached is None:
+        return 404, "Not Found", {}, b""
+
+    body, etag = cached
+    content_type = "application/json" if key == "manifest" else "image/png"
+    extra = {"ETag": etag, "Cache-Control": "no-cache", "Content-Type": content_type}
+    if etag in (tag.strip() for tag in headers.get("if-none-match", "").split(",")):
+        return 304, "Not Modified", extra, b""
+    return 200, "OK", extra, body
+
+
+async def handle_connection(reader, writer, store, executor):
+    """Serve requests on one connection until the client closes it or asks to, HTTP/1.1 keep-alive."""
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+
+            headers = {}
+            for _ in range(SERVER_MAX_HEADER_LINES):
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+            try:
+                method, target, version = request_line.decode("latin-1").split()
+            except ValueError:
+                status, reason, extra, body = 400, "Bad Request", {}, b""
+                method, version = "GET", "HTTP/1.0"
+            else:
+                status, reason, extra, body = await respond(method, target, headers, store, executor)
+
+            keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+            head = [f"HTTP/1.1 {status} {reason}", f"Content-Length: {len(body) if status != 304 else 0}"]
+            head += [f"{name}: {value}" for name, value in extra.items()]
+            if not keep_alive:
+                head.append("Connection: close")
+            writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1"))
+            if method != "HEAD":
+                writer.write(body)
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(tile_dir, host=SERVER_HOST, port=SERVER_PORT, ready=None):
+    """Run the server until cancelled. ready, a threading or multiprocessing Event, is set once it listens."""
+    store = TileStore(tile_dir, SERVER_CACHE_MAX_BYTES)
+    executor = ThreadPoolExecutor(SERVER_WORKERS)
+    server = await asyncio.start_server(
+        lambda reader, writer: handle_connection(reader, writer, store, executor), host, port)
+    print(f"Serving {len(store.keys)} tiles from {tile_dir} on http://{host}:{port}")
+    if ready is not None:
+        ready.set()
+
+    started = time.monotonic()
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        executor.shutdown(wait=False)
+        print(f"Served for {time.monotonic() - started:.0f}s, response cache stats: {store.stats()}")
+
+
+# === Main ===
+def main():
+    parser = argparse.ArgumentParser(description="Serve map tiles over HTTP to viewers on this machine.")
+    parser.add_argument("--tile-dir", default=map_tools.MAP_TILE_DIR)
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args.tile_dir, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
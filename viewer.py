@@ -1,12 +1,34 @@
+import csv
+import ctypes
+import heapq
+import http.client
+import io
+import itertools
+import json
+import math
 import os  # file system
 import pygame
 
-from queue import PriorityQueue
+import map_tools
+import multiprocessing
+from collections import OrderedDict, deque
+from multiprocessing import shared_memory
+from queue import Empty, LifoQueue
+import select
+import struct
+import sys
 import threading
 import time
+import urllib.parse
+import zlib
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, without it compact tiles are all kept compressed
+    np = None
 
 # === Constants ===
-# Map tiles
+# Map tiles, the bounds are replaced from the tile manifest at startup
 MAP_TILE_DIR = "/mnt/c/Users/andre/Downloads/OSRS_map_rip/2025-05-22"
 Z_MIN = 0
 Z_MAX = 3
@@ -16,6 +38,9 @@ Y_MIN = 19
 Y_MAX = 196
 TILE_SIZE = 256
 
+# Zoom pyramid built by map_tools, level n tiles each cover 2^n x 2^n full-resolution tiles
+PYRAMID_LEVELS = 3
+
 # Initial map tile loading
 INIT_CENTER = (50, 50)  # initial focus tile
 VIEWPORT_RADIUS = 4
@@ -25,6 +50,64 @@ INIT_Y_MIN = INIT_CENTER[1] - VIEWPORT_RADIUS
 INIT_Y_MAX = INIT_CENTER[1] + VIEWPORT_RADIUS
 INIT_Z = 0
 
+# Startup
+FAST_STARTUP = True  # draw the first frame straight away and stream tiles in, False decodes the INIT_CENTER block first
+STARTUP_QUEUE_BATCH = 2048  # full-resolution tiles added to the background queue per frame, nearest INIT_CENTER first
+STARTUP_BUDGET = 0.25  # seconds from main() to the first frame, a slower startup is reported as over budget
+
+# Tile residency cache
+TILE_CACHE_MAX_TILES = None  # maximum number of distinct decoded tiles, None for no tile limit
+TILE_CACHE_MAX_BYTES = 1024 * 1024 * 1024  # maximum bytes of resident surfaces, None for no byte limit
+TILE_CACHE_LOW_WATER = 0.9  # evict down to this fraction of the budget so evictions run in batches
+
+# Tile archive packed by map_tools, used instead of the loose PNGs when present
+USE_TILE_ARCHIVE = True
+
+# Tile server started with tile_server.py, used instead of the tile directory when set
+TILE_SERVER_URL = None  # e.g. "http://127.0.0.1:8765"
+TILE_SERVER_CONNECTIONS = 4  # pooled keep-alive connections, one loader thread each
+TILE_SERVER_TIMEOUT = 10  # seconds
+
+# Tile directory watching, reloading tiles added, changed or removed on disk while the viewer runs
+WATCH_TILE_DIR = True  # only the loose PNGs are watched, not the tile archive or a tile server
+WATCH_POLL_INTERVAL = 1.0  # seconds between checks of the level directory mtimes when inotify is not available
+WATCH_RESCAN_INTERVAL = 120.0  # seconds between full re-lists, lower it where inotify misses changes (Windows drives under WSL)
+WATCH_MAX_CHANGES_PER_FRAME = 256  # changed tiles applied per frame, the rest wait for the next frames
+
+# Load scheduler
+SCHEDULER_KEEP_RADIUS = 64  # queued tiles farther than this many tiles from the view are dropped
+SCHEDULER_REORDER_INTERVAL = 0.1  # seconds between re-sorts of the background queue while the view moves
+
+# Predictive prefetch, tiles of the views likely to come next are loaded ahead of the background queue
+PREFETCH_VELOCITY_WINDOW = 0.15  # seconds of drag motion averaged into the drag velocity
+PREFETCH_LOOKAHEAD = 0.5  # seconds ahead along the drag to load
+PREFETCH_MAX_TILES = 64  # predicted tiles queued per frame
+
+# Decode pool, worker processes decode PNGs into shared memory slots for the loader thread
+DECODE_WORKERS = max(1, (os.cpu_count() or 2) - 1)  # 0 decodes on the loader thread instead
+DECODE_SLOTS_PER_WORKER = 4  # tiles each worker can have in flight
+DECODE_SLOT_BYTES = TILE_SIZE * TILE_SIZE * 3  # one RGB tile
+
+# Compact tiles
+COMPACT_TILES = False  # keep tiles as 8-bit palettized Surfaces, or compressed if they have too many colours
+COMPACT_COMPRESS_LEVEL = 1  # zlib level for tiles with more than 256 colours, fast to expand when drawn
+
+# Scaled tile cache
+SCALED_CACHE_MAX_BYTES = 256 * 1024 * 1024  # maximum bytes of scaled surfaces kept for the current zoom level
+SMOOTH_SCALE_BUDGET = 0.004  # seconds per frame for smoothscale, tiles past it are scaled fast and refined later
+
+# Rendering, a frame is only drawn when something on screen changed
+RENDER_LOADING_POLL = 0.02  # seconds to wait for input between checks for newly loaded tiles
+RENDER_IDLE_POLL = 0.5  # seconds to wait for input once nothing is loading
+TEXT_CACHE_MAX_ENTRIES = 64  # rendered overlay strings kept
+
+# Frame profiler, the HUD is toggled with F3
+PROFILER_HUD_KEY = pygame.K_F3
+PROFILER_WINDOW = 120  # frames averaged by the HUD
+PROFILER_HUD_INTERVAL = 0.25  # seconds between HUD text refreshes
+PROFILER_LOG_PATH = None  # stream one record per frame to this .csv or .jsonl file, None to disable
+PROFILER_FONT_SIZE = 22
+
 # Zoom levels
 ZOOM_LEVELS = [4.0, 2.0, 1.0, 0.5, 0.25, 0.125]
 ZOOM_SPEED = 0.02  # percent zoom per frame
@@ -34,6 +117,20 @@ BACKGROUND_COLOUR = (0, 0, 0)
 GRID_LINE_COLOUR = (255, 255, 255)
 BACKGROUND_LINE_COLOUR = (51, 51, 51)
 
+# Grid overlay, toggled with G. A tile is one map square, a region of 64x64 game tiles, and a chunk is 8x8 game tiles
+GRID_KEY = pygame.K_g
+GAME_TILES_PER_TILE = 64
+CHUNK_SIZE = 8  # game tiles
+GRID_LINES = [  # (spacing in game tiles, RGBA colour, smallest on-screen spacing in pixels to draw them at)
+    (CHUNK_SIZE, (255, 255, 255, 48), 16),  # chunks
+    (GAME_TILES_PER_TILE, GRID_LINE_COLOUR + (255,), 0),  # regions / map squares
+]
+GRID_BLOCK_SIZE = 512  # pixels per side of the pre-rendered overlay blocks, a multiple of a chunk at every zoom level
+GRID_CACHE_MAX_BLOCKS = 64  # 1 MiB each at 512 px
+HIGHLIGHT_CHUNKS_PATH = None  # JSON file of highlighted chunk sets, None for none
+HIGHLIGHT_COLOURS = [(0, 255, 0, 64), (255, 200, 0, 64), (0, 160, 255, 64), (255, 0, 80, 64)]  # one per set
+HIGHLIGHT_POLL = 1.0  # seconds between checks of the highlight file for changes
+
 # Constants for overlay layout and appearance
 PADDING_RIGHT = 32
 PADDING_TOP = 32
@@ -54,35 +151,975 @@ class ViewerState:
         self.offset = [0, 0]  # x and y scroll offset
         self.dragging = False
         self.drag_start = (0, 0)
-
+        self.drag_samples = deque()  # (time, dx, dy) of recent drag motion
+        self.velocity = (0.0, 0.0)  # drag velocity in pixels per second
+        self.show_profiler = False
+        self.show_grid = True
+        self.redraw = True  # composite and flip the next frame even if nothing changed
+        self.frames_drawn = 0
+        self.startup = {}  # startup phase -> seconds, see StartupTimer
+
+
+# === Tile Residency Cache ===
+class TileCache:
+    """Decoded tiles kept within a memory budget, evicting the tiles farthest from the view first.
+
+    Not thread safe on its own, callers hold tile_lock around every call.
+    """
+
+    def __init__(self, max_tiles=TILE_CACHE_MAX_TILES, max_bytes=TILE_CACHE_MAX_BYTES):
+        self.max_tiles = max_tiles
+        self.max_bytes = max_bytes
+        self.tiles = {}  # (z, x, y, level) -> Surface, or CompressedTile in compact mode
+        self.blob_of = {}  # (z, x, y, level) -> pixel hash, for tiles identical to another tile
+        self.blobs = {}  # blob id -> [Surface, size in bytes, number of resident keys sharing it]
+        self.last_drawn = {}  # (z, x, y, level) -> frame the tile was last drawn on
+        self.missing = set()  # keys with no loadable tile on disk
+        self.prefetched = set()  # keys loaded by a prefetch and not drawn yet
+        self.present = None  # keys listed in the tile manifest, None to probe the disk instead
+        self.view = (INIT_CENTER[0], INIT_CENTER[1], INIT_Z)  # tile at the centre of the viewport
+        self.frame = 0
+        self.worst_priority = None  # priority of the farthest tile kept by the last eviction
+
+        # Statistics
+        self.bytes = 0
+        self.evictions = 0
+        self.misses = 0
+        self.loads = 0
+        self.shared_loads = 0
+        self.prefetch_loads = 0
+        self.prefetch_hits = 0  # prefetched tiles drawn before they were evicted
+        self.prefetch_wasted = 0  # prefetched tiles evicted without ever being drawn
+
+    def __contains__(self, key):
+        return key in self.tiles
+
+    def __len__(self):
+        return len(self.tiles)
+
+    def get(self, key):
+        return self.tiles.get(key)
+
+    def blob_id(self, key):
+        """Identifier of the tile's pixels, the same for every key with identical content."""
+        return self.blob_of.get(key, key)
+
+    def shared(self, key):
+        """Resident Surface of an identical tile under another key, or None."""
+        blob = self.blobs.get(self.blob_id(key))
+        return None if blob is None else blob[0]
+
+    def put(self, key, image):
+        if key in self.tiles:
+            self.release(key)
+
+        # Identical tiles share one Surface and are only counted against the budget once
+        blob_id = self.blob_id(key)
+        blob = self.blobs.get(blob_id)
+        if blob is None:
+            size = tile_bytes(image)
+            blob = self.blobs[blob_id] = [image, size, 0]
+            self.bytes += size
+            self.loads += 1
+        blob[2] += 1
+        self.tiles[key] = blob[0]
+
+        if self.over_budget(1.0):
+            self.evict()
+
+    def release(self, key):
+        del self.tiles[key]
+        self.last_drawn.pop(key, None)
+        if key in self.prefetched:
+            self.prefetched.discard(key)
+            self.prefetch_wasted += 1
+
+        blob_id = self.blob_id(key)
+        blob = self.blobs[blob_id]
+        blob[2] -= 1
+        if blob[2] == 0:
+            del self.blobs[blob_id]
+            self.bytes -= blob[1]
+
+    def touch(self, key):
+        self.last_drawn[key] = self.frame
+        if key in self.prefetched:
+            self.prefetched.discard(key)
+            self.prefetch_hits += 1
+
+    def forget(self, key, exists):
+        """Drop a tile whose file was added, changed or removed on disk, so that its next load reads the file
+        again. Returns the blob id its pixels were cached under."""
+        blob_id = self.blob_id(key)
+        if key in self.tiles:
+            self.release(key)
+        self.blob_of.pop(key, None)  # the dedup index describes the old pixels
+        self.missing.discard(key)
+        if self.present is not None:
+            if exists:
+                self.present.add(key)
+            else:
+                self.present.discard(key)
+        return blob_id
+
+    def mark_prefetched(self, key):
+        if key in self.tiles and key not in self.last_drawn:
+            self.prefetched.add(key)
+            self.prefetch_loads += 1
+
+    def set_view(self, x, y, z):
+        self.view = (x, y, z)
+        self.frame += 1
+
+    def priority(self, key):
+        return key_priority(key, self.view)
+
+    def over_budget(self, fraction):
+        if self.max_tiles is not None and len(self.blobs) > self.max_tiles * fraction:
+            return True
+        if self.max_bytes is not None and self.bytes > self.max_bytes * fraction:
+            return True
+        return False
+
+    def rejects(self, key):
+        """True if loading the tile now would only get it evicted again straight away."""
+        if self.worst_priority is None or not self.over_budget(TILE_CACHE_LOW_WATER):
+            return False
+        return self.priority(key) > self.worst_priority
+
+    def evict(self):
+        """Drop the farthest, least recently drawn tiles until the cache is under its low-water mark."""
+        ranked = sorted(self.tiles, key=lambda k: (-self.priority(k), self.last_drawn.get(k, -1)))
+
+        for key in ranked:
+            if not self.over_budget(TILE_CACHE_LOW_WATER):
+                self.worst_priority = self.priority(key)
+                break
+            self.release(key)
+            self.evictions += 1
+
+    def absent(self, key):
+        """True if there is no loadable tile for the key."""
+        return key in self.missing or (self.present is not None and key not in self.present)
+
+    def request(self, key, scheduler):
+        """Queue a tile that is not resident, unless it is known to be missing."""
+        if key in self.tiles or self.absent(key):
+            return
+        scheduler.put(key)
+
+    def stats(self):
+        return {
+            "resident": len(self.tiles),
+            "distinct": len(self.blobs),
+            "bytes": self.bytes,
+            "evictions": self.evictions,
+            "misses": self.misses,
+            "loads": self.loads,
+            "shared_loads": self.shared_loads,
+            "prefetch_loads": self.prefetch_loads,
+            "prefetch_hits": self.prefetch_hits,
+            "prefetch_wasted": self.prefetch_wasted,
+        }
+
+
+# === Load Scheduler ===
+class TileScheduler:
+    """Queued tile loads, served in order of distance from the live view.
+
+    Tiles visible right now are served first, nearest the centre first, then the tiles predicted to
+    come into view next in the order they were predicted. Everything else waits in a background heap
+    that is re-sorted as the view moves, dropping tiles that have fallen too far behind; those are
+    requested again if they come back into view. The re-sort runs on a loader thread outside the lock,
+    which the UI thread takes every frame. Thread safe.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.view = (INIT_CENTER[0], INIT_CENTER[1], INIT_Z)
+        self.pending = set()  # keys waiting to be handed to the loader
+        self.active = set()  # keys handed to the loader and not yet done
+        self.visible = []  # heap of (priority, key) for keys on screen now
+        self.prefetch = []  # heap of (rank, key) for keys predicted to come into view
+        self.prefetch_active = set()  # keys handed to the loader from the prefetch heap
+        self.background = []  # heap of (priority, key), priorities as of background_view
+        self.background_view = self.view
+        self.reordered = 0.0
+        self.reordering = False  # a loader is re-sorting a snapshot of pending outside the lock
+        self.queued_while_reordering = []  # (priority, key) pushed since that snapshot
+
+        # Statistics
+        self.dropped = 0
+        self.served_visible = 0
+        self.served_prefetch = 0
+        self.served_background = 0
+
+    def put(self, key):
+        """Queue a key, returning False if it was already queued or loading."""
+        return self.put_many([key]) == 1
+
+    def put_many(self, keys):
+        """Queue keys under one lock, returning how many were not queued or loading already."""
+        added = 0
+        with self.condition:
+            for key in keys:
+                if key in self.pending or key in self.active:
+                    continue
+                self.pending.add(key)
+                self.push((key_priority(key, self.view), key))
+                added += 1
+            self.condition.notify(added)
+        return added
+
+    def set_view(self, x, y, z, visible_keys, prefetch_keys=()):
+        """Follow the viewport, queueing the visible keys ahead of everything else and the prefetch
+        keys, most likely first, right behind them.
+
+        Returns how many of the visible keys were not queued yet.
+        """
+        added = 0
+        with self.condition:
+            self.view = (x, y, z)
+            self.visible = []
+            for key in visible_keys:
+                if key in self.active:
+                    continue
+                entry = (key_priority(key, self.view), key)
+                if key not in self.pending:
+                    # Also queue it behind the view, in case it scrolls away before it is served
+                    self.pending.add(key)
+                    self.push(entry)
+                    added += 1
+                self.visible.append(entry)
+            heapq.heapify(self.visible)
+
+            self.prefetch = []  # appended in rank order, so already a heap
+            for rank, key in enumerate(prefetch_keys):
+                if key in self.active:
+                    continue
+                if key not in self.pending:
+                    self.pending.add(key)
+                    self.push((key_priority(key, self.view), key))
+                self.prefetch.append((rank, key))
+
+            if self.visible or self.prefetch:
+                self.condition.notify()
+        return added
+
+    def push(self, entry):
+        heapq.heappush(self.background, entry)
+        if self.reordering:
+            self.queued_while_reordering.append(entry)
+
+    def drops(self, key, view):
+        z, x, y, level = key
+        vx, vy, vz = view
+        return abs(z - vz) > 1 or abs((x << level) - vx) + abs((y << level) - vy) > SCHEDULER_KEEP_RADIUS
+
+    def start_reorder(self):
+        """Return (view, pending keys) to re-sort if the view moved and the last re-sort is old enough, else None."""
+        if self.reordering or self.background_view == self.view:
+            return None
+        if time.monotonic() - self.reordered <= SCHEDULER_REORDER_INTERVAL:
+            return None
+        self.reordering = True
+        return self.view, list(self.pending)
+
+    def finish_reorder(self, view, keys):
+        """Re-sort a snapshot of the pending keys against view without holding the lock, then swap it in,
+        dropping keys that are too far away."""
+        keep = []
+        dropped = []
+        for key in keys:
+            if self.drops(key, view):
+                dropped.append(key)
+            else:
+                keep.append((key_priority(key, view), key))
+        heapq.heapify(keep)
+
+        with self.condition:
+            # Keys queued meanwhile are only in the old heap, keys served meanwhile are skipped as stale entries
+            for entry in self.queued_while_reordering:
+                heapq.heappush(keep, entry)
+            requeued = {key for _, key in self.queued_while_reordering}
+            dropped = [key for key in dropped if key not in requeued]
+            self.pending.difference_update(dropped)
+            self.dropped += len(dropped)
+            self.background = keep
+            self.background_view = view
+            self.reordered = time.monotonic()
+            self.reordering = False
+            self.queued_while_reordering = []
+
+    def next_urgent_key(self):
+        # Entries for keys served through the other heap or dropped are stale, skip them
+        while self.visible:
+            _, key = heapq.heappop(self.visible)
+            if key in self.pending:
+                self.served_visible += 1
+                return key
+        while self.prefetch:
+            _, key = heapq.heappop(self.prefetch)
+            if key in self.pending:
+                self.served_prefetch += 1
+                self.prefetch_active.add(key)
+                return key
+        return None
+
+    def next_background_key(self):
+        while self.background:
+            _, key = heapq.heappop(self.background)
+            if key in self.pending:
+                self.served_background += 1
+                return key
+        return None
+
+    def get(self, block=True):
+        """Hand the most urgent key to the loader, raising queue.Empty if there is none and not block."""
+        while True:
+            with self.condition:
+                key = self.next_urgent_key()
+                snapshot = None
+                if key is None:
+                    # Re-sort the background heap before serving from it if the view moved
+                    snapshot = self.start_reorder()
+                    if snapshot is None:
+                        key = self.next_background_key()
+                if key is not None:
+                    self.pending.discard(key)
+                    self.active.add(key)
+                    return key
+                if snapshot is None:
+                    if not block:
+                        raise Empty
+                    self.condition.wait(SCHEDULER_REORDER_INTERVAL)  # wake up for a deferred reorder
+                    continue
+            self.finish_reorder(*snapshot)
+
+    def done(self, key):
+        """Mark a key's load finished, returning True if it was handed out as a prefetch."""
+        with self.condition:
+            self.active.discard(key)
+            prefetched = key in self.prefetch_active
+            self.prefetch_active.discard(key)
+            return prefetched
+
+    def idle(self):
+        with self.condition:
+            return not self.pending and not self.active
+
+    def loading(self, key):
+        """True if the key has been handed to a loader that has not finished with it."""
+        with self.condition:
+            return key in self.active
+
+    def stats(self):
+        with self.condition:
+            return {
+                "pending": len(self.pending),
+                "active": len(self.active),
+                "dropped": self.dropped,
+                "served_visible": self.served_visible,
+                "served_prefetch": self.served_prefetch,
+                "served_background": self.served_background,
+            }
+
+
+# === Scaled Tile Cache ===
+class ScaledTileCache:
+    """Tiles already scaled to one settled zoom level, least recently used dropped first.
+
+    Tiles scaled while the view moves, or once the frame's smoothscale budget is spent, use the fast
+    nearest-neighbour scaler and are smoothscaled again by refine() once the view is still. The whole
+    cache is cleared when the level changes. Only the UI thread touches it.
+    """
+
+    def __init__(self, max_bytes=SCALED_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.level = None  # zoom level the cached surfaces are scaled to
+        self.tiles = OrderedDict()  # blob id (see TileCache.blob_id) -> scaled Surface
+        self.rough = OrderedDict()  # blob id -> full tile, for tiles scaled fast and not refined yet
+        self.bytes = 0
+
+        # Statistics
+        self.hits = 0
+        self.misses = 0
+        self.refined = 0
+
+    def set_level(self, level):
+        if level == self.level:
+            return
+        self.level = level
+        self.tiles.clear()
+        self.rough.clear()
+        self.bytes = 0
+
+    def get(self, key):
+        scaled = self.tiles.get(key)
+        if scaled is not None:
+            self.tiles.move_to_end(key)
+        return scaled
+
+    def scale(self, key, image, size, fast=False):
+        """Return the tile scaled to size pixels, scaling and caching it on a miss."""
+        scaled = self.get(key)
+        if scaled is not None:
+            self.hits += 1
+            return scaled
+
+        self.misses += 1
+        image = expand_tile(image)
+        if fast and size != image.get_width():
+            scaled = pygame.transform.scale(image, (size, size))
+            self.rough[key] = image
+        else:
+            scaled = pygame.transform.smoothscale(image, (size, size))
+        self.tiles[key] = scaled
+        self.bytes += scaled.get_pitch() * scaled.get_height()
+
+        while self.bytes > self.max_bytes and len(self.tiles) > 1:
+            dropped_key, dropped = self.tiles.popitem(last=False)
+            self.rough.pop(dropped_key, None)
+            self.bytes -= dropped.get_pitch() * dropped.get_height()
+        return scaled
+
+    def discard(self, key):
+        """Drop the scaled Surface of a blob whose pixels changed."""
+        scaled = self.tiles.pop(key, None)
+        if scaled is not None:
+            self.rough.pop(key, None)
+            self.bytes -= scaled.get_pitch() * scaled.get_height()
+
+    def refine(self, deadline):
+        """Smoothscale fast-scaled tiles again until deadline, returning the blob ids that changed."""
+        refined = set()
+        while self.rough and time.perf_counter() < deadline:
+            key, image = self.rough.popitem(last=False)
+            scaled = self.tiles[key]
+            self.tiles[key] = pygame.transform.smoothscale(image, scaled.get_size())
+            refined.add(key)
+        self.refined += len(refined)
+        return refined
+
+    def stats(self):
+        return {
+            "level": self.level,
+            "resident": len(self.tiles),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "rough": len(self.rough),
+            "refined": self.refined,
+        }
+
+
+# === Compact Tiles ===
+# In compact mode the loaders keep tiles with 256 colours or fewer as 8-bit palettized Surfaces, a
+# quarter of a display-format tile, and the rest as zlib compressed RGB. Both are lossless. With a
+# decode pool the workers do the conversion, and the UI thread expands a tile to display format only
+# when it has to scale it.
+class CompressedTile:
+    """RGB pixels of a tile with too many colours for a palette, compressed until drawn."""
+
+    def __init__(self, size, data):
+        self.size = size
+        self.data = data  # zlib compressed RGB
+
+    def expand(self):
+        return pygame.image.frombytes(zlib.decompress(self.data), self.size, "RGB")
+
+
+def tile_surface(surface):
+    """Copy a freshly decoded tile into the form the tile cache keeps, converting it for fast blits."""
+    if not COMPACT_TILES:
+        return surface.convert()
+    return compact_tile(surface)
+
+
+def compact_tile(surface):
+    """An 8-bit palettized copy of the tile if it has 256 colours or fewer, else a CompressedTile."""
+    size = surface.get_size()
+    quantized = palette_indices(surface)
+    if quantized is None:
+        pixels = pygame.image.tobytes(surface, "RGB")
+        return CompressedTile(size, zlib.compress(pixels, COMPACT_COMPRESS_LEVEL))
+    return palettized_surface(size, *quantized)
+
+
+def palette_indices(surface):
+    """Split a tile into (palette, one index byte per pixel), or None if it has more than 256 colours."""
+    if np is None:
+        return None
+
+    # One 32-bit integer per pixel, then a plain sort finds the distinct colours far faster than np.unique
+    pixels = np.frombuffer(pygame.image.tobytes(surface, "RGBX"), "<u4")
+    ordered = np.sort(pixels)
+    distinct = np.empty(len(ordered), bool)
+    distinct[0] = True
+    np.not_equal(ordered[1:], ordered[:-1], out=distinct[1:])
+    colours = ordered[distinct]
+    if len(colours) > 256:
+        return None
+
+    palette = [(c & 0xFF, (c >> 8) & 0xFF, (c >> 16) & 0xFF) for c in colours.tolist()]
+    return palette, np.searchsorted(colours, pixels).astype(np.uint8).tobytes()
+
+
+def palettized_surface(size, palette, indices):
+    image = pygame.image.frombytes(bytes(indices), size, "P")
+    image.set_palette(palette)
+    return image
+
+
+def expand_tile(image):
+    """Display-format Surface of a cached tile, smoothscale only takes 24 or 32-bit Surfaces."""
+    if isinstance(image, CompressedTile):
+        return image.expand().convert()
+    if image.get_bitsize() == 8:
+        return image.convert()
+    return image
+
+
+def tile_bytes(image):
+    if isinstance(image, CompressedTile):
+        return len(image.data)
+    return image.get_pitch() * image.get_height()
+
+
+# === Decode Pool ===
+def decode_worker(shm_name, tasks, results, compact, started):
+    """Worker process: decode PNGs into the shared memory slot named by each task.
+
+    The slot holds raw RGB, or in compact mode palette indices or compressed RGB, as described by the
+    form sent back with the result: None, ("P", palette) or ("Z", compressed length). started is set
+    once the worker is up and taking tasks.
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    started.set()
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            slot, path = task
+            try:
+                surface = pygame.image.load(path)
+                size = surface.get_size()
+                if size[0] * size[1] * 3 > DECODE_SLOT_BYTES:
+                    raise ValueError(f"{size[0]}x{size[1]} tile does not fit in a decode slot")
+                quantized = palette_indices(surface) if compact else None
+                if quantized is not None:
+                    palette, data = quantized
+                    form = ("P", palette)
+                else:
+                    data = pygame.image.tobytes(surface, "RGB")
+                    form = None
+                    if compact:
+                        compressed = zlib.compress(data, COMPACT_COMPRESS_LEVEL)
+                        if len(compressed) <= DECODE_SLOT_BYTES:
+                            data = compressed
+                            form = ("Z", len(data))
+                start = slot * DECODE_SLOT_BYTES
+                shm.buf[start:start + len(data)] = data
+                results.put((slot, size, None, form))
+            except Exception as e:
+                results.put((slot, None, str(e), None))
+    finally:
+        shm.close()
+
+
+class DecodePool:
+    """Worker processes that decode tiles into shared memory, wrapped as Surfaces by the loader thread.
+
+    Only the loader thread uses the pool once it is started. Spawned workers take a while to import
+    pygame, until the first one is up the loader decodes on its own thread.
+    """
+
+    def __init__(self, workers=DECODE_WORKERS):
+        os.environ["PYGAME_HIDE_SUPPORT_PROMPT"] = "1"  # one greeting is enough, not one per worker
+
+        slots = workers * DECODE_SLOTS_PER_WORKER
+        self.shm = shared_memory.SharedMemory(create=True, size=slots * DECODE_SLOT_BYTES)
+        self.free_slots = list(range(slots))
+        self.in_flight = {}  # slot -> (key, path)
+        self.running = False  # a worker has started
+
+        # Spawn rather than fork, the parent has a display and threads running
+        context = multiprocessing.get_context("spawn")
+        self.tasks = context.Queue()
+        self.results = context.Queue()
+        self.started = context.Event()
+        self.processes = [
+            context.Process(
+                target=decode_worker, args=(self.shm.name, self.tasks, self.results, COMPACT_TILES, self.started),
+                daemon=True)
+            for _ in range(workers)]
+        for process in self.processes:
+            process.start()
+
+    def ready(self):
+        if not self.running:
+            self.running = self.started.is_set()
+        return self.running
+
+    def submit(self, key, path):
+        slot = self.free_slots.pop()
+        self.in_flight[slot] = (key, path)
+        self.tasks.put((slot, path))
+
+    def receive(self):
+        """Wait for the next decoded tile, returning (key, path, image, error)."""
+        slot, size, error, form = self.results.get()
+        key, path = self.in_flight.pop(slot)
+
+        image = None
+        if error is None:
+            start = slot * DECODE_SLOT_BYTES
+            if form is None:
+                with self.shm.buf[start:start + size[0] * size[1] * 3] as view:
+                    # frombuffer wraps the slot without copying, tile_surface() makes the only copy
+                    image = tile_surface(pygame.image.frombuffer(view, size, "RGB"))
+            elif form[0] == "P":
+                image = palettized_surface(size, form[1], self.shm.buf[start:start + size[0] * size[1]])
+            else:
+                image = CompressedTile(size, bytes(self.shm.buf[start:start + form[1]]))
+
+        self.free_slots.append(slot)
+        return key, path, image, error
+
+    def close(self):
+        for _ in self.processes:
+            self.tasks.put(None)
+        for process in self.processes:
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
+        self.shm.close()
+        self.shm.unlink()
+
+
+# === Frame Profiler ===
+class TimedLock:
+    """tile_lock, adding up the time spent waiting to acquire it on the UI thread and on the loaders."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.render_wait = 0.0
+        self.loader_wait = 0.0
+
+    def __enter__(self):
+        start = time.perf_counter()
+        self.lock.acquire()
+        waited = time.perf_counter() - start
+        # Updated while holding the lock, so the totals need no lock of their own
+        if threading.current_thread() is threading.main_thread():
+            self.render_wait += waited
+        else:
+            self.loader_wait += waited
+        return self
+
+    def __exit__(self, *exc_info):
+        self.lock.release()
+
+
+class FrameProfiler:
+    """Per-frame timings of the main loop stages, with loader, tile_lock, queue and cache counters.
+
+    The UI thread times its stages with lap(), loader threads add theirs with loader_lap(). Each
+    drawn frame becomes one record, averaged over the last PROFILER_WINDOW frames for the HUD and
+    optionally streamed to a CSV or JSON-lines file.
+    """
+
+    STAGES = ("events", "requests", "lookup", "scale", "grid", "overlay", "hud", "flip")
+    LOADER_STAGES = ("claim", "decode", "store")
+
+    def __init__(self, tile_lock, log_path=None, window=PROFILER_WINDOW):
+        self.tile_lock = tile_lock
+        self.history = deque(maxlen=window)  # most recent frame records
+        self.frame = 0
+        self.started = self.frame_start = self.last_lap = time.perf_counter()
+        self.stages = dict.fromkeys(self.STAGES, 0.0)  # seconds spent in each stage this frame
+        self.counters = {}  # per-frame counts reported by the stages
+
+        self.loader_lock = threading.Lock()
+        self.loader = dict.fromkeys(self.LOADER_STAGES, 0.0)  # seconds, summed over all loader threads
+        self.totals = None  # cumulative counters as of the previous frame
+
+        self.font = None
+        self.hud = None
+        self.hud_updated = 0.0
+
+        self.log_path = log_path
+        self.log_file = None
+        self.log_writer = None
+        if log_path:
+            self.log_file = open(log_path, "w", newline="")
+
+    # --- UI thread ---
+    def start_frame(self):
+        self.frame_start = self.last_lap = time.perf_counter()
+        for stage in self.stages:
+            self.stages[stage] = 0.0
+        self.counters.clear()
+
+    def lap(self, stage):
+        """Charge the time since the previous lap to a stage."""
+        now = time.perf_counter()
+        self.stages[stage] += now - self.last_lap
+        self.last_lap = now
+
+    def count(self, name, n):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def cumulative(self, tile_cache, scaled_cache):
+        # Plain attribute reads, a value from mid-update only shifts a count into the next frame
+        with self.loader_lock:
+            totals = {f"loader_{stage}": seconds for stage, seconds in self.loader.items()}
+        totals["lock_wait_render"] = self.tile_lock.render_wait
+        totals["lock_wait_loader"] = self.tile_lock.loader_wait
+        totals["tiles_loaded"] = tile_cache.loads + tile_cache.shared_loads
+        totals["prefetch_loads"] = tile_cache.prefetch_loads
+        totals["prefetch_hits"] = tile_cache.prefetch_hits
+        totals["prefetch_wasted"] = tile_cache.prefetch_wasted
+        totals["scaled_hits"] = scaled_cache.hits
+        totals["scaled_misses"] = scaled_cache.misses
+        return totals
+
+    def end_frame(self, tile_cache, scaled_cache, scheduler):
+        now = time.perf_counter()
+        totals = self.cumulative(tile_cache, scaled_cache)
+        previous = self.totals or dict.fromkeys(totals, 0)
+        self.totals = totals
+        delta = {name: totals[name] - previous[name] for name in totals}
+        queue = scheduler.stats()
+
+        record = {"frame": self.frame, "time_s": round(now - self.started, 4)}
+        record["frame_ms"] = (now - self.frame_start) * 1000
+        for stage, seconds in self.stages.items():
+            record[f"{stage}_ms"] = seconds * 1000
+        for name in ("lock_wait_render", "lock_wait_loader") + tuple(f"loader_{s}" for s in self.LOADER_STAGES):
+            record[f"{name}_ms"] = delta[name] * 1000
+        record["queue_pending"] = queue["pending"]
+        record["queue_active"] = queue["active"]
+        record["tiles_loaded"] = delta["tiles_loaded"]
+        record["tile_hits"] = self.counters.get("tile_hits", 0)
+        record["tile_misses"] = self.counters.get("tile_misses", 0)
+        record["scaled_hits"] = delta["scaled_hits"]
+        record["scaled_misses"] = delta["scaled_misses"]
+        record["prefetch_loads"] = delta["prefetch_loads"]
+        record["prefetch_hits"] = delta["prefetch_hits"]
+        record["prefetch_wasted"] = delta["prefetch_wasted"]
+
+        self.history.append(record)
+        self.frame += 1
+        if self.log_file is not None:
+            self.write(record)
+
+    def write(self, record):
+        if self.log_path.endswith((".jsonl", ".json")):
+            self.log_file.write(json.dumps(record) + "\n")
+            return
+        if self.log_writer is None:
+            self.log_writer = csv.DictWriter(self.log_file, fieldnames=list(record))
+            self.log_writer.writeheader()
+        self.log_writer.writerow(record)
+
+    def summary(self):
+        """Averages over the recent frames, per frame unless the name says otherwise."""
+        frames = len(self.history)
+        if not frames:
+            return None
+        seconds = sum(r["frame_ms"] for r in self.history) / 1000
+
+        def mean(name):
+            return sum(r[name] for r in self.history) / frames
+
+        def rate(hits, misses):
+            total = sum(r[hits] + r[misses] for r in self.history)
+            return sum(r[hits] for r in self.history) / total if total else None
+
+        summary = {name: mean(name) for name in self.history[-1] if name.endswith("_ms")}
+        summary["fps"] = frames / seconds if seconds else 0.0
+        summary["frame_max_ms"] = max(r["frame_ms"] for r in self.history)
+        summary["tiles_per_s"] = sum(r["tiles_loaded"] for r in self.history) / seconds if seconds else 0.0
+        summary["tile_hit_rate"] = rate("tile_hits", "tile_misses")
+        summary["scaled_hit_rate"] = rate("scaled_hits", "scaled_misses")
+        # Prefetched tiles are drawn or evicted long after they load, so these rates are since startup
+        prefetched = self.totals["prefetch_loads"]
+        summary["prefetch_loads"] = prefetched
+        summary["prefetch_hit_rate"] = self.totals["prefetch_hits"] / prefetched if prefetched else None
+        summary["prefetch_waste_rate"] = self.totals["prefetch_wasted"] / prefetched if prefetched else None
+        summary["queue_pending"] = self.history[-1]["queue_pending"]
+        summary["queue_active"] = self.history[-1]["queue_active"]
+        return summary
+
+    def hud_lines(self):
+        summary = self.summary()
+        if summary is None:
+            return ["Profiler: waiting for frames"]
+
+        def stages(names, prefix=""):
+            return "  ".join(f"{name} {summary[f'{prefix}{name}_ms']:.1f}" for name in names) + " ms"
+
+        def percent(value):
+            return "-" if value is None else f"{value:.0%}"
+
+        return [
+            f"{summary['fps']:.0f} FPS, frame {summary['frame_ms']:.1f} ms avg, {summary['frame_max_ms']:.1f} max",
+            stages(self.STAGES[:4]),
+            stages(self.STAGES[4:]),
+            f"tile_lock wait: UI {summary['lock_wait_render_ms']:.2f}, loaders {summary['lock_wait_loader_ms']:.2f} ms",
+            "Loaders: " + stages(self.LOADER_STAGES, "loader_"),
+            f"Queue: {summary['queue_pending']} pending, {summary['queue_active']} loading, "
+            f"{summary['tiles_per_s']:.0f} tiles/s",
+            f"Hit rate: tiles {percent(summary['tile_hit_rate'])}, scaled {percent(summary['scaled_hit_rate'])}",
+            f"Prefetch since start: {summary['prefetch_loads']} loaded, {percent(summary['prefetch_hit_rate'])} drawn, "
+            f"{percent(summary['prefetch_waste_rate'])} evicted unused",
+        ]
+
+    def hud_stale(self):
+        return self.hud is None or time.perf_counter() - self.hud_updated > PROFILER_HUD_INTERVAL
+
+    def draw_hud(self, screen, window_size):
+        """Draw the averages in the bottom left corner, re-rendering the text a few times a second."""
+        if self.hud_stale():
+            if self.font is None:
+                self.font = pygame.font.SysFont(None, PROFILER_FONT_SIZE)
+            lines = [self.font.render(text, True, GRID_LINE_COLOUR) for text in self.hud_lines()]
+            line_height = self.font.get_linesize()
+            width = max(line.get_width() for line in lines) + 2 * OVERLAY_PADDING
+            height = line_height * len(lines) + 2 * OVERLAY_PADDING
+            self.hud = pygame.Surface((width, height), pygame.SRCALPHA)
+            self.hud.fill((0, 0, 0, OVERLAY_BG_ALPHA))
+            for i, line in enumerate(lines):
+                self.hud.blit(line, (OVERLAY_PADDING, OVERLAY_PADDING + i * line_height))
+            self.hud_updated = time.perf_counter()
+        screen.blit(self.hud, (PADDING_RIGHT, window_size[1] - self.hud.get_height() - PADDING_TOP))
+
+    # --- Loader threads ---
+    def loader_lap(self, stage, start):
+        """Charge the time since start to a loader stage and return the current time."""
+        now = time.perf_counter()
+        with self.loader_lock:
+            self.loader[stage] += now - start
+        return now
+
+    def close(self):
+        if self.log_file is not None:
+            self.log_file.close()
+            print(f"Frame profile written to {self.log_path}")
+
+
+class StartupTimer:
+    """Wall-clock time of each startup phase, from main() being called to the first frame on screen."""
+
+    def __init__(self):
+        self.started = self.last = time.perf_counter()
+        self.phases = {}  # phase -> seconds, in the order they ran
+
+    def lap(self, phase):
+        now = time.perf_counter()
+        self.phases[phase] = now - self.last
+        self.last = now
+
+    def report(self):
+        total = self.last - self.started
+        phases = ", ".join(f"{phase} {seconds * 1000:.0f} ms" for phase, seconds in self.phases.items())
+        print(f"First frame after {total * 1000:.0f} ms: {phases}")
+        if STARTUP_BUDGET is not None and total > STARTUP_BUDGET:
+            print(f"Startup is over its {STARTUP_BUDGET * 1000:.0f} ms budget")
 
 
 # === Initialization Functions ===
-def initialize_window():
+def initialize_window(window_size=None, loading_screen=True):
     os.environ["SDL_VIDEO_WINDOW_POS"] = "0,0"
     os.environ["SDL_AUDIODRIVER"] = "dummy"  # set a dummy audio output to avoid error in pygame
     
     pygame.init()
     
-    info = pygame.display.Info()  # Get screen dimensions
-    window_size = (info.current_w - 12, info.current_h - 82)
+    if window_size is None:
+        info = pygame.display.Info()  # Get screen dimensions
+        window_size = (info.current_w - 12, info.current_h - 82)
     screen = pygame.display.set_mode(window_size, pygame.RESIZABLE)  # Create the screen surface
     pygame.display.set_caption("OSRS Map Viewer")
         
-    pygame.mouse.set_cursor(pygame.SYSTEM_CURSOR_ARROW)
+    set_cursor(pygame.SYSTEM_CURSOR_ARROW)
 
-    # Loading screen
+    # Loading screen, only worth drawing when the first frame is not coming straight after
     screen.fill(BACKGROUND_COLOUR)  # Clear background
-    font = pygame.font.SysFont(None, FONT_SIZE)
-    loading_text = "Loading..."
-    loading_text_surf = font.render(loading_text, True, GRID_LINE_COLOUR)
-    loading_text_rect = loading_text_surf.get_rect(center=(window_size[0] / 2, window_size[1] / 2))
-    screen.blit(loading_text_surf, loading_text_rect)
+    if loading_screen:
+        font = pygame.font.SysFont(None, FONT_SIZE)
+        loading_text = "Loading..."
+        loading_text_surf = font.render(loading_text, True, GRID_LINE_COLOUR)
+        loading_text_rect = loading_text_surf.get_rect(center=(window_size[0] / 2, window_size[1] / 2))
+        screen.blit(loading_text_surf, loading_text_rect)
     pygame.display.flip()
 
     return screen, window_size
 
 
+def set_cursor(cursor):
+    try:
+        pygame.mouse.set_cursor(cursor)
+    except pygame.error:
+        pass  # No system cursors, e.g. under the dummy video driver
+
+
+def tile_path(z, x, y, level=0):
+    """Path of a tile image, level 0 being the full-resolution tiles and higher levels the pyramid."""
+    return os.path.join(map_tools.pyramid_level_dir(level, MAP_TILE_DIR), f"{z}_{x}_{y}.png")
+
+
+def load_manifest(client=None):
+    """Read the tile manifest, from the tile server if there is a client, and take the map bounds from it."""
+    global Z_MIN, Z_MAX, X_MIN, X_MAX, Y_MIN, Y_MAX
+
+    if client is not None:
+        manifest = json.loads(client.get("/manifest.json"))
+    else:
+        manifest = map_tools.load_manifest(MAP_TILE_DIR)
+    bounds = manifest["bounds"]
+    if bounds:
+        Z_MIN, Z_MAX = bounds["z_min"], bounds["z_max"]
+        X_MIN, X_MAX = bounds["x_min"], bounds["x_max"]
+        Y_MIN, Y_MAX = bounds["y_min"], bounds["y_max"]
+
+    return manifest
+
+
+def manifest_keys(manifest):
+    """Set of (z, x, y, level) keys of every tile listed in the manifest."""
+    present = set()
+    for level in range(PYRAMID_LEVELS + 1):
+        for z, x, y in map_tools.manifest_tiles(manifest, level):
+            present.add((z, x, y, level))
+    return present
+
+
+def load_dedup_index(manifest):
+    """Map tiles identical to another tile to their pixel hash, empty without a dedup index."""
+    index = map_tools.load_dedup_index(MAP_TILE_DIR)
+    if index is None:
+        return {}
+    return map_tools.dedup_blobs(manifest, index)
+
+
+def detect_pyramid_levels(present):
+    """Return the highest consecutive pyramid level with tiles, 0 when there is no pyramid."""
+    levels_with_tiles = {key[3] for key in present}
+    levels = 0
+    while levels < PYRAMID_LEVELS and levels + 1 in levels_with_tiles:
+        levels += 1
+    return levels
+
+
+def pyramid_level(zoom, max_level):
+    """Coarsest pyramid level that still has at least one source pixel per screen pixel."""
+    if zoom >= 1.0:
+        return 0
+    return min(max_level, int(math.log2(1.0 / zoom) + 1e-9))
+
+
 def compute_priority(x, y, z, viewport_x, viewport_y, viewport_z):
     dz = abs(z - viewport_z)
     dx = abs(x - viewport_x)
@@ -90,121 +1127,989 @@ def compute_priority(x, y, z, viewport_x, viewport_y, viewport_z):
     return dz * 1000 + dx + dy  # Weight z distance higher if needed
 
 
-def init_load():
+def key_priority(key, view):
+    """compute_priority for a (z, x, y, level) key against a (x, y, z) view centre."""
+    z, x, y, level = key
+    return compute_priority(x << level, y << level, z, *view)
+
+
+def init_load(present, archive=None, client=None):
     loaded_tiles = {}  # dictionary of loaded tile images
 
     for x in range(INIT_X_MIN, INIT_X_MAX + 1):
         for y in range(INIT_Y_MIN, INIT_Y_MAX + 1):
-            filename = f"{INIT_Z}_{x}_{y}.png"
-            img_path = os.path.join(MAP_TILE_DIR, filename)
-            if not os.path.exists(img_path):
+            if (INIT_Z, x, y, 0) not in present:
                 continue
+            filename = f"{INIT_Z}_{x}_{y}.png"
+            img_path = tile_path(INIT_Z, x, y)
 
             try:
-                surface = pygame.image.load(img_path)
-                image = surface.convert()
+                if archive is not None:
+                    image = archive_surface(archive, (INIT_Z, x, y, 0))
+                elif client is not None:
+                    image = server_surface(client, (INIT_Z, x, y, 0))
+                else:
+                    surface = pygame.image.load(img_path)
+                    image = tile_surface(surface)
             except Exception as e:
                 print(f"Error loading {filename}: {e}")
                 image = pygame.Surface((TILE_SIZE, TILE_SIZE)).convert()
                 image.fill(BACKGROUND_COLOUR)
 
-            loaded_tiles[(INIT_Z, x, y)] = image
+            loaded_tiles[(INIT_Z, x, y, 0)] = image
 
     print(f"Loaded {len(loaded_tiles)} initial tiles.")  # Total number of tiles loaded at this time
     return loaded_tiles
 
 
-def tile_loader_thread(tile_queue, loaded_tiles, tile_lock):
-    while not tile_queue.empty():
-        priority, (z, x, y) = tile_queue.get()
+def keys_by_distance(present, center):
+    """Yield the full-resolution keys in present nearest the (x, y, z) center first, in compute_priority
+    order, walking rings around the center instead of sorting every key up front."""
+    cx, cy, cz = center
+    max_distance = max(cx - X_MIN, X_MAX - cx) + max(cy - Y_MIN, Y_MAX - cy)
+    for z in sorted(range(Z_MIN, Z_MAX + 1), key=lambda z: abs(z - cz)):
+        for distance in range(max_distance + 1):
+            for x in range(max(X_MIN, cx - distance), min(X_MAX, cx + distance) + 1):
+                dy = distance - abs(x - cx)
+                for y in (cy - dy, cy + dy) if dy else (cy,):
+                    if (z, x, y, 0) in present:
+                        yield z, x, y, 0
 
-        filename = f"{z}_{x}_{y}.png"
-        path = os.path.join(MAP_TILE_DIR, filename)
 
-        if not os.path.exists(path):
-            continue
+def queue_startup_tiles(backlog, scheduler, tile_cache, tile_lock):
+    """Queue the next STARTUP_QUEUE_BATCH keys of the startup backlog, returning False once it is used up."""
+    keys = list(itertools.islice(backlog, STARTUP_QUEUE_BATCH))
+    with tile_lock:
+        wanted = [key for key in keys if key not in tile_cache and not tile_cache.absent(key)]
+    scheduler.put_many(wanted)
+    return len(keys) == STARTUP_QUEUE_BATCH
 
-        try:
-            surface = pygame.image.load(path)
-            image = surface.convert()
-            with tile_lock:
-                loaded_tiles[(z, x, y)] = image
-        except Exception as e:
-            print(f"Error loading {filename}: {e}")
-            continue
 
-        time.sleep(0.001)  # Yield to UI thread
+def claim_tile(key, scheduler, tile_cache, tile_lock):
+    """Return the path to load for a dequeued key, or None if the key no longer needs loading."""
+    z, x, y, level = key
 
+    # Skip tiles that arrived meanwhile or would be evicted as soon as they load,
+    # and reuse the Surface of an identical tile that is already resident
+    with tile_lock:
+        skip = key in tile_cache or tile_cache.absent(key) or tile_cache.rejects(key)
+        if not skip:
+            image = tile_cache.shared(key)
+            if image is not None:
+                tile_cache.put(key, image)
+                tile_cache.shared_loads += 1
+                skip = True
+    if skip:
+        scheduler.done(key)
+        return None
+
+    path = tile_path(z, x, y, level)
+
+    # The manifest already lists what exists, only probe the disk without one
+    if tile_cache.present is None and not os.path.exists(path):
+        with tile_lock:
+            tile_cache.missing.add(key)
+        scheduler.done(key)
+        return None
+    return path
+
+
+def store_tile(key, path, image, error, scheduler, tile_cache, tile_lock):
+    with tile_lock:
+        if image is not None:
+            tile_cache.put(key, image)
+        else:
+            tile_cache.missing.add(key)
+    if scheduler.done(key) and image is not None:
+        with tile_lock:
+            tile_cache.mark_prefetched(key)
+    if image is None:
+        print(f"Error loading {os.path.basename(path)}: {error}")
+
+
+def file_surface(key, path):
+    """Decode a loose tile PNG."""
+    return tile_surface(pygame.image.load(path))
+
+
+def load_tile(key, scheduler, tile_cache, tile_lock, profiler, decode=file_surface):
+    """Claim, decode and store one dequeued key on the calling thread, decode(key, path) making its Surface."""
+    start = time.perf_counter()
+    path = claim_tile(key, scheduler, tile_cache, tile_lock)
+    start = profiler.loader_lap("claim", start)
+    if path is None:
+        return
+
+    image = error = None
+    try:
+        image = decode(key, path)
+    except Exception as e:
+        error = e
+    start = profiler.loader_lap("decode", start)
+    store_tile(key, path, image, error, scheduler, tile_cache, tile_lock)
+    profiler.loader_lap("store", start)
+
+
+def tile_loader_thread(scheduler, tile_cache, tile_lock, profiler):
+    while True:
+        load_tile(scheduler.get(), scheduler, tile_cache, tile_lock, profiler)
+        time.sleep(0.001)  # Yield to UI thread
 
-# === Rendering Functions ===
-def draw_tiles_and_grid(screen, loaded_tiles, offset, zoom, current_z, window_size, tile_lock):
-    tile_size_zoomed = TILE_SIZE * zoom
-    visible_rect = pygame.Rect(0, 0, *window_size)
 
-    screen.fill(BACKGROUND_COLOUR)  # Clear background
+def pooled_loader_thread(scheduler, tile_cache, tile_lock, decode_pool, profiler):
+    """Loader that hands decoding to the worker processes and only wraps the results as Surfaces."""
+    while True:
+        if not decode_pool.ready():
+            # The first visible tiles need not wait for the workers to start
+            load_tile(scheduler.get(), scheduler, tile_cache, tile_lock, profiler)
+            continue
 
+        # Keep every decode slot busy, blocking on the scheduler only when nothing is in flight
+        while decode_pool.free_slots:
+            try:
+                key = scheduler.get(block=not decode_pool.in_flight)
+            except Empty:
+                break
+            start = time.perf_counter()
+            path = claim_tile(key, scheduler, tile_cache, tile_lock)
+            if path is not None:
+                decode_pool.submit(key, path)
+            profiler.loader_lap("claim", start)
+
+        if decode_pool.in_flight:
+            # Waiting on the result queue releases the GIL, so the UI thread is never starved.
+            # The decode stage is the time spent waiting for the workers
+            start = time.perf_counter()
+            result = decode_pool.receive()
+            start = profiler.loader_lap("decode", start)
+            store_tile(*result, scheduler, tile_cache, tile_lock)
+            profiler.loader_lap("store", start)
+
+
+def open_tile_archive(manifest):
+    """Open the packed tile archive, or return None to fall back to the loose PNGs, also when tiles were
+    added, rewritten or removed since it was packed."""
+    path = map_tools.archive_path(MAP_TILE_DIR)
+    if not USE_TILE_ARCHIVE or not os.path.exists(path):
+        return None
+    try:
+        archive = map_tools.TileArchive(path)
+        changed, removed = map_tools.archive_changes(archive, manifest, path)
+    except (OSError, ValueError) as e:
+        print(f"Not using tile archive {path}: {e}")
+        return None
+    if changed or removed:
+        print(f"Not using tile archive {path}: {changed} tiles added or changed and {removed} removed since it "
+              f"was packed, pack it again with map_tools")
+        archive.close()
+        return None
+    return archive
+
+
+def archive_surface(archive, key):
+    """Wrap an archive payload as a Surface, the tile_surface() copy being the only one."""
+    with archive.payload(key) as payload:
+        return tile_surface(pygame.image.frombuffer(payload, (archive.tile_size, archive.tile_size), "RGB"))
+
+
+def archive_loader_thread(scheduler, tile_cache, tile_lock, archive, profiler):
+    """Loader reading from the memory-mapped archive, nothing to decode so no worker processes."""
+    def decode(key, path):
+        return archive_surface(archive, key)
+
+    while True:
+        load_tile(scheduler.get(), scheduler, tile_cache, tile_lock, profiler, decode)
+
+
+class TileClient:
+    """Keep-alive HTTP connections to a tile server, shared by the loader threads."""
+
+    def __init__(self, url, connections=TILE_SERVER_CONNECTIONS):
+        url = urllib.parse.urlsplit(url)
+        self.host = url.hostname
+        self.port = url.port or 80
+        self.pool = LifoQueue()  # idle connections, None for one not opened yet
+        for _ in range(connections):
+            self.pool.put(None)
+
+    def get(self, path):
+        """Return the body of a 200 response, None for a 404, raising OSError for anything else."""
+        connection = self.pool.get()
+        try:
+            # A pooled connection may have been closed by the server since, retry once on a new one
+            for attempt in range(2):
+                reused = connection is not None
+                if connection is None:
+                    connection = http.client.HTTPConnection(self.host, self.port, timeout=TILE_SERVER_TIMEOUT)
+                try:
+                    connection.request("GET", path)
+                    response = connection.getresponse()
+                    body = response.read()
+                    break
+                except (OSError, http.client.HTTPException) as e:
+                    connection.close()
+                    connection = None
+                    if not reused or attempt:
+                        raise OSError(f"{path}: {e}") from e
+        finally:
+            self.pool.put(connection)
+
+        if response.status == 404:
+            return None
+        if response.status != 200:
+            raise OSError(f"{path}: HTTP {response.status} {response.reason}")
+        return body
+
+    def close(self):
+        while not self.pool.empty():
+            connection = self.pool.get()
+            if connection is not None:
+                connection.close()
+
+
+def server_surface(client, key):
+    """Fetch a tile from the tile server and decode it, raising OSError if the server does not have it."""
+    z, x, y, level = key
+    body = client.get(f"/{z}/{x}/{y}?level={level}")
+    if body is None:
+        raise OSError(f"{z}_{x}_{y} level {level} is not on the tile server")
+    return tile_surface(pygame.image.load(io.BytesIO(body), "tile.png"))
+
+
+def server_loader_thread(scheduler, tile_cache, tile_lock, client, profiler):
+    """Loader fetching tiles from the tile server, several run side by side on the pooled connections."""
+    def decode(key, path):
+        return server_surface(client, key)
+
+    while True:
+        load_tile(scheduler.get(), scheduler, tile_cache, tile_lock, profiler, decode)
+
+
+def visible_tile_range(offset, zoom, window_size, level=0):
+    """Return the (x_min, x_max, y_min, y_max) tile indices of a pyramid level inside the window,
+    clamped to the map."""
+    tile_size_zoomed = TILE_SIZE * zoom
+    cols_left = math.floor(-offset[0] / tile_size_zoomed)
+    cols_right = math.ceil((window_size[0] - offset[0]) / tile_size_zoomed) - 1
+    rows_top = math.floor(-offset[1] / tile_size_zoomed)
+    rows_bottom = math.ceil((window_size[1] - offset[1]) / tile_size_zoomed) - 1
+
+    x_min = max(X_MIN, X_MIN + cols_left)
+    x_max = min(X_MAX, X_MIN + cols_right)
+    y_min = max(Y_MIN, Y_MAX - rows_bottom)
+    y_max = min(Y_MAX, Y_MAX - rows_top)
+    return x_min >> level, x_max >> level, y_min >> level, y_max >> level
+
+
+def view_keys(offset, zoom, z, window_size, max_level):
+    """Keys of the tiles a view shows, at the pyramid level its zoom draws from."""
+    level = pyramid_level(zoom, max_level)
+    x_min, x_max, y_min, y_max = visible_tile_range(offset, zoom, window_size, level)
+    return [(z, x, y, level) for x in range(x_min, x_max + 1) for y in range(y_min, y_max + 1)]
+
+
+def request_visible_tiles(
+        scheduler, tile_cache, tile_lock, offset, zoom, current_z, window_size, max_level, prefetch_views=()):
+    """Point the cache and scheduler at the viewport, queue visible tiles that are not resident and
+    prefetch the tiles of prefetch_views, (offset, zoom, plane) views listed most likely first."""
+    x_min, x_max, y_min, y_max = visible_tile_range(offset, zoom, window_size)
+    center = ((x_min + x_max) / 2, (y_min + y_max) / 2, current_z)
+
+    visible = view_keys(offset, zoom, current_z, window_size, max_level)
+    seen = set(visible)
+    predicted = []
+    for view in prefetch_views:
+        # Within a view, the tiles closest to what is on screen now are needed first
+        keys = [key for key in view_keys(*view, window_size, max_level) if key not in seen]
+        keys.sort(key=lambda key: key_priority(key, center))
+        seen.update(keys)
+        predicted.extend(keys)
+
+    wanted = []
+    prefetch = []
+    with tile_lock:
+        tile_cache.set_view(*center)
+        for key in visible:
+            if key not in tile_cache and not tile_cache.absent(key):
+                wanted.append(key)
+        for key in predicted:
+            if len(prefetch) == PREFETCH_MAX_TILES:
+                break
+            if key not in tile_cache and not tile_cache.absent(key) and not tile_cache.rejects(key):
+                prefetch.append(key)
+
+    added = scheduler.set_view(*center, wanted, prefetch)
+    if added:
+        with tile_lock:
+            tile_cache.misses += added
+
+
+# === Tile Directory Watcher ===
+class Inotify:
+    """inotify through ctypes, to hear about directory changes without polling. Linux only."""
+
+    EVENT = struct.Struct("iIII")  # watch descriptor, mask, cookie, length of the name that follows
+    CLOSE_WRITE = 0x8
+    MOVED_FROM = 0x40
+    MOVED_TO = 0x80
+    CREATE = 0x100
+    DELETE = 0x200
+    OVERFLOW = 0x4000  # the kernel dropped events
+    IS_DIR = 0x40000000
+    MASK = CLOSE_WRITE | MOVED_FROM | MOVED_TO | CREATE | DELETE
+
+    def __init__(self):
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is only available on Linux")
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self.dirs = {}  # watch descriptor -> directory
+
+    def add(self, path):
+        """Watch a directory, adding it again being harmless."""
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), self.MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+        self.dirs[wd] = path
+
+    def read(self, timeout):
+        """Return (directory, name, mask) for the events that arrive within timeout seconds."""
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        data = os.read(self.fd, 64 * 1024)
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = self.EVENT.unpack_from(data, offset)
+            offset += self.EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            events.append((self.dirs.get(wd), name, mask))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class TileWatcher:
+    """Tile files added, changed or removed on disk while the viewer runs.
+
+    A background thread keeps the manifest's sizes and mtimes up to date and records every tile whose
+    entry changes. With inotify only the files named by events are stat'ed; without it a level directory
+    is listed again when its own mtime moves. Either way, every WATCH_RESCAN_INTERVAL all levels are
+    listed again, for files rewritten in place, which leave the directory mtime alone, and changes
+    inotify does not see. Thread safe.
+    """
+
+    def __init__(self, tile_dir, manifest):
+        self.tile_dir = tile_dir
+        self.levels = manifest["levels"]  # taken over from the caller and kept current
+        self.level_dirs = {map_tools.pyramid_level_dir(level, tile_dir): level for level in range(PYRAMID_LEVELS + 1)}
+        # level -> mtime_ns of the level directory when it was last listed, the levels the manifest is current for
+        self.dir_mtimes = map_tools.current_dir_mtimes(manifest, tile_dir)
+        self.lock = threading.Lock()
+        self.changed = {}  # (z, x, y, level) -> True if the tile exists now, False if it was removed
+        self.backend = None
+
+        # Statistics
+        self.events = 0
+        self.listings = 0
+        self.found = 0
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        inotify = None
+        try:
+            inotify = Inotify()
+            self.watch_dirs(inotify)
+        except (OSError, AttributeError) as e:  # AttributeError for a libc without inotify
+            print(f"Not using inotify, polling {self.tile_dir} for changes instead: {e}")
+            if inotify is not None:
+                inotify.close()
+            inotify = None
+        self.backend = "poll" if inotify is None else "inotify"
+
+        self.poll()  # catch up with changes made since the manifest was loaded, one stat per level if there are none
+        rescanned = time.monotonic()
+        while True:
+            if inotify is not None:
+                self.handle(inotify, inotify.read(WATCH_POLL_INTERVAL))
+            else:
+                time.sleep(WATCH_POLL_INTERVAL)
+                self.poll()
+            if time.monotonic() - rescanned > WATCH_RESCAN_INTERVAL:
+                self.poll(full=True)
+                rescanned = time.monotonic()
+
+    def watch_dirs(self, inotify):
+        """Watch the level directories that exist, and the pyramid directory for levels created later."""
+        pyramid_dir = os.path.join(self.tile_dir, map_tools.PYRAMID_DIR_NAME)
+        for path in [*self.level_dirs, pyramid_dir]:
+            if os.path.isdir(path):
+                inotify.add(path)
+
+    def handle(self, inotify, events):
+        for directory, name, mask in events:
+            self.events += 1
+            if mask & Inotify.OVERFLOW:
+                self.poll(full=True)
+            elif mask & Inotify.IS_DIR:
+                # The pyramid directory or a level directory created, moved or removed as a whole
+                path = os.path.join(directory, name)
+                changed = [(level_dir, level) for level_dir, level in self.level_dirs.items()
+                           if path in (level_dir, os.path.dirname(level_dir))]
+                if changed:
+                    self.watch_dirs(inotify)
+                for level_dir, level in changed:
+                    self.list_level(level_dir, level)
+            elif directory in self.level_dirs and not mask & Inotify.CREATE:
+                # Files are reported once written, their creation would only reload them twice
+                self.check(self.level_dirs[directory], directory, name)
+
+    def check(self, level, level_dir, name):
+        """Stat one file named by an event."""
+        match = map_tools.TILE_NAME_PATTERN.match(name)
+        if match is None:
+            return
+        z, x, y = (int(part) for part in match.groups())
+        try:
+            stat = os.stat(os.path.join(level_dir, name))
+            entry = [stat.st_size, stat.st_mtime_ns]
+        except FileNotFoundError:
+            entry = None
+        self.update(level, str(z), f"{x}_{y}", entry)
+
+    def poll(self, full=False):
+        """List the level directories whose mtime moved since they were last listed, or all of them if full."""
+        for level_dir, level in self.level_dirs.items():
+            try:
+                mtime = os.stat(level_dir).st_mtime_ns
+            except FileNotFoundError:
+                mtime = None
+            if full or level not in self.dir_mtimes or mtime != self.dir_mtimes[level]:
+                self.list_level(level_dir, level)
+
+    def list_level(self, level_dir, level):
+        """List a level directory and record every tile that differs from what is known about it."""
+        # The mtime is read before listing, so a change during the listing is caught by the next poll
+        try:
+            self.dir_mtimes[level] = os.stat(level_dir).st_mtime_ns
+            listed = map_tools.scan_level(level_dir, [])
+        except FileNotFoundError:
+            self.dir_mtimes[level] = None
+            listed = {}
+        self.listings += 1
+
+        known = self.levels.get(str(level), {})
+        for z in listed.keys() | known.keys():
+            new, old = listed.get(z, {}), known.get(z, {})
+            for xy in new.keys() | old.keys():
+                self.update(level, z, xy, new.get(xy))
+
+    def update(self, level, z, xy, entry):
+        """Record a tile's [size, mtime_ns], None if it is gone, queueing it if that differs from before."""
+        tiles = self.levels.setdefault(str(level), {}).setdefault(z, {})
+        if tiles.get(xy) == entry:
+            return
+        if entry is None:
+            del tiles[xy]
+        else:
+            tiles[xy] = entry
+        x, y = xy.split("_")
+        with self.lock:
+            self.changed[(int(z), int(x), int(y), level)] = entry is not None
+            self.found += 1
+
+    def changes(self, limit):
+        """Take up to limit (key, exists) changes, oldest first."""
+        with self.lock:
+            taken = list(itertools.islice(self.changed.items(), limit))
+            for key, _ in taken:
+                del self.changed[key]
+        return taken
+
+    def postpone(self, changes):
+        """Hand back changes that could not be applied yet, unless the tile changed again meanwhile."""
+        with self.lock:
+            for key, exists in changes:
+                self.changed.setdefault(key, exists)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "backend": self.backend,
+                "events": self.events,
+                "listings": self.listings,
+                "changes": self.found,
+                "pending": len(self.changed),
+            }
+
+
+def apply_tile_changes(watcher, tile_cache, scaled_cache, map_layer, scheduler, tile_lock, max_level):
+    """Drop the tiles that changed on disk and queue them to load again, a bounded batch per frame.
+
+    Returns the pyramid level count, which changes when a pyramid level is built or removed.
+    """
+    changes = watcher.changes(WATCH_MAX_CHANGES_PER_FRAME)
+    if not changes:
+        return max_level
+
+    busy = []
     with tile_lock:
-        for (z, x, y), image in loaded_tiles.items():
-            if not isinstance(image, pygame.Surface) or z != current_z:
+        for key, exists in changes:
+            # A loader may be reading the old file, wait until it stored the tile and replace that
+            if scheduler.loading(key):
+                busy.append((key, exists))
                 continue
+            blob_id = tile_cache.forget(key, exists)
+            scaled_cache.discard(blob_id)
+            scaled_cache.discard(key)
+            map_layer.invalidate(key)
+            if exists:
+                tile_cache.request(key, scheduler)
+        if any(key[3] > 0 for key, _ in changes):
+            max_level = detect_pyramid_levels(tile_cache.present)
+    watcher.postpone(busy)
+    return max_level
 
-            draw_x = (x - X_MIN) * tile_size_zoomed + offset[0]
-            draw_y = (Y_MAX - y) * tile_size_zoomed + offset[1]
-            tile_rect = pygame.Rect(draw_x, draw_y, tile_size_zoomed, tile_size_zoomed)
 
-            if not visible_rect.colliderect(tile_rect):
-                continue
+# === Rendering Functions ===
+class MapLayer:
+    """The tiles and grid drawn into an off-screen surface that is kept between frames.
+
+    Each frame only the parts that changed are redrawn: nothing when the view and the visible tiles
+    are the same, the exposed edge strips after a drag scrolls the surface, and the squares of tiles
+    that loaded, were evicted, were refined or changed on disk. Zoom, floor, pyramid level and grid
+    changes redraw everything.
+    """
+
+    def __init__(self, window_size):
+        self.surface = pygame.Surface(window_size).convert()
+        self.view = None  # (zoom, plane, pyramid level, grid version) the surface was drawn at, None to redraw all
+        self.offset = None  # scroll offset the surface was drawn at
+        self.drawn = {}  # (z, x, y, level) -> blob id of every tile on the surface
+        self.stale = set()  # keys whose squares must be redrawn even if the same blob id is drawn there
+
+    def invalidate(self, key):
+        """Redraw a tile's square on the next update, for tiles whose pixels changed under the same key."""
+        self.stale.add(key)
+
+    def damage(self, view, offset, drawn, zoom):
+        """Scroll the surface to the new offset and return the rects to redraw, None for everything."""
+        if view != self.view:
+            return None
+
+        areas = []
+        dx = offset[0] - self.offset[0]
+        dy = offset[1] - self.offset[1]
+        if dx or dy:
+            width, height = self.surface.get_size()
+            # Only whole-pixel moves can reuse the surface, zoom animations leave fractional offsets
+            if not (float(dx).is_integer() and float(dy).is_integer()) or abs(dx) >= width or abs(dy) >= height:
+                return None
+            dx, dy = int(dx), int(dy)
+            self.surface.scroll(dx, dy)
+            if dx > 0:
+                areas.append(pygame.Rect(0, 0, dx, height))
+            elif dx < 0:
+                areas.append(pygame.Rect(width + dx, 0, -dx, height))
+            if dy > 0:
+                areas.append(pygame.Rect(0, 0, width, dy))
+            elif dy < 0:
+                areas.append(pygame.Rect(0, height + dy, width, -dy))
+
+        # Tiles that loaded, were evicted or now share another Surface
+        for key in drawn.keys() | self.drawn.keys():
+            if drawn.get(key) != self.drawn.get(key):
+                areas.append(tile_rect(key, offset, zoom))
+        return areas
+
+    def update(self, tile_cache, scaled_cache, grid, state, tile_lock, max_level, profiler):
+        """Bring the surface up to date with the view, returning False if nothing had to be redrawn."""
+        level = pyramid_level(state.zoom, max_level)
+        window_size = self.surface.get_size()
+        visible_tiles = lookup_visible_tiles(
+            tile_cache, tile_lock, state.offset, state.zoom, state.current_z, window_size, level, profiler)
+
+        # Swap in smoothscaled tiles for the ones scaled fast, but only while the view is still
+        interacting = state.dragging or state.zoom != state.zoom_target
+        refined = set()
+        if not interacting:
+            refined = scaled_cache.refine(time.perf_counter() + SMOOTH_SCALE_BUDGET)
+            profiler.lap("scale")
+
+        grid = grid if state.show_grid else None
+        view = (state.zoom, state.current_z, level, grid and grid.version)
+        offset = tuple(state.offset)
+        drawn = {key: blob_id for key, _, blob_id in visible_tiles}
+        areas = self.damage(view, offset, drawn, state.zoom)
+        self.view, self.offset, self.drawn = view, offset, drawn
+        if areas is not None:
+            areas += [tile_rect(key, offset, state.zoom) for key, _, blob_id in visible_tiles if blob_id in refined]
+            areas += [tile_rect(key, offset, state.zoom) for key in self.stale
+                      if key[0] == state.current_z and key[3] == level]
+        self.stale.clear()
+        if areas is not None and not areas:
+            return False
 
-            # Scale and blit the tile
-            scaled = pygame.transform.smoothscale(image, (int(tile_size_zoomed), int(tile_size_zoomed)))
-            screen.blit(scaled, tile_rect)
+        draw_tiles_and_grid(
+            self.surface, visible_tiles, scaled_cache, grid, state.offset, state.zoom, state.zoom_target,
+            state.current_z, areas, interacting, profiler)
+        return True
 
-            # Draw a white outline around the tile
-            pygame.draw.rect(screen, GRID_LINE_COLOUR, tile_rect, 1)
 
+def tile_rect(key, offset, zoom):
+    """Window rect covered by a tile, floored so that whole-pixel scrolls move every tile by exactly that much."""
+    z, x, y, level = key
+    span = 1 << level
+    tile_size_zoomed = TILE_SIZE * zoom
+    draw_x = ((x << level) - X_MIN) * tile_size_zoomed + offset[0]
+    draw_y = (Y_MAX - ((y << level) + span - 1)) * tile_size_zoomed + offset[1]
+    tile_size_drawn = int(tile_size_zoomed * span)
+    return pygame.Rect(math.floor(draw_x), math.floor(draw_y), tile_size_drawn, tile_size_drawn)
 
-def draw_overlay(screen, window_size, state, all_tiles_loaded):
-    font = pygame.font.SysFont(None, FONT_SIZE)
 
-    # --- Zoom level and floor ---
+def lookup_visible_tiles(tile_cache, tile_lock, offset, zoom, current_z, window_size, level, profiler):
+    """Return (key, image, blob id) for the resident tiles inside the window.
+
+    Only the keys inside the window are looked up and copied out, so the loader is not held up by the draw.
+    """
+    x_min, x_max, y_min, y_max = visible_tile_range(offset, zoom, window_size, level)
+    visible_tiles = []
+    not_loaded = 0
+    with tile_lock:
+        for x in range(x_min, x_max + 1):
+            for y in range(y_min, y_max + 1):
+                key = (current_z, x, y, level)
+                image = tile_cache.get(key)
+                if image is None:
+                    if not tile_cache.absent(key):
+                        not_loaded += 1
+                    continue
+                tile_cache.touch(key)
+                visible_tiles.append((key, image, tile_cache.blob_id(key)))
+    profiler.count("tile_hits", len(visible_tiles))
+    profiler.count("tile_misses", not_loaded)
+    profiler.lap("lookup")
+    return visible_tiles
+
+
+def draw_tiles_and_grid(
+        surface, visible_tiles, scaled_cache, grid, offset, zoom, zoom_target, plane, areas, interacting, profiler):
+    """Draw the tiles and the grid, None for no grid, inside areas, a list of rects, or over the whole surface if None.
+
+    While interacting, during a drag or the zoom animation, tiles are scaled with the fast nearest-neighbour
+    scaler so the frame keeps up with the display, and ScaledTileCache.refine() smooths them afterwards.
+    """
+    if areas is None:
+        areas = [surface.get_rect()]
+
+    # Scaled tiles are only built once the zoom has settled on a level, the animation
+    # reuses whatever level is cached and scales from it instead of from the full tile
+    settled = abs(zoom - zoom_target) <= 0.001
+    if settled:
+        scaled_cache.set_level(zoom_target)
+    smooth_deadline = time.perf_counter() + SMOOTH_SCALE_BUDGET
+
+    # Scale only the tiles that overlap the damaged areas
+    tiles = []
+    for key, image, blob_id in visible_tiles:
+        rect = tile_rect(key, offset, zoom)
+        if rect.collidelist(areas) < 0:
+            continue
+        if settled:
+            fast = interacting or time.perf_counter() > smooth_deadline
+            scaled, position = scaled_cache.scale(blob_id, image, rect.width, fast), rect.topleft
+        else:
+            scaled = scaled_cache.get(blob_id)
+            if scaled is None or scaled.get_width() < rect.width:
+                scaled = expand_tile(image)  # Never upscale a smaller cached level
+            scaled, position = scale_visible(scaled, rect, surface.get_rect())
+        tiles.append((rect, scaled, position))
+
+    # Areas can overlap, so each one is finished before the next, the translucent grid must not be
+    # blended twice over the same tiles
+    for area in areas:
+        surface.set_clip(area)
+        surface.fill(BACKGROUND_COLOUR)  # Clear background
+        for rect, scaled, position in tiles:
+            if rect.colliderect(area):
+                surface.blit(scaled, position)
+        profiler.lap("scale")
+
+        # The grid comes pre-rendered once the zoom has settled, while it animates only a white
+        # outline is drawn around each tile
+        if grid is not None and settled:
+            grid.draw(surface, offset, zoom, plane, area)
+        elif grid is not None:
+            for rect, _, _ in tiles:
+                if rect.colliderect(area):
+                    draw_outline(surface, rect)
+        profiler.lap("grid")
+    surface.set_clip(None)
+
+
+def scale_visible(image, rect, bounds):
+    """Fast-scale image to rect, or only the part of it inside bounds, returning (Surface, position to blit at).
+
+    Zoomed in, most of a tile lies off screen, so only the source pixels that land inside bounds are scaled.
+    """
+    clip = rect.clip(bounds)
+    if clip == rect or not clip:
+        return pygame.transform.scale(image, rect.size), rect.topleft
+
+    # Whole source pixels covering the clip, each mapped to where scaling the whole tile would put it
+    width, height = image.get_size()
+    x0 = (clip.left - rect.left) * width // rect.width
+    x1 = -((rect.left - clip.right) * width // rect.width)
+    y0 = (clip.top - rect.top) * height // rect.height
+    y1 = -((rect.top - clip.bottom) * height // rect.height)
+    left = rect.left + x0 * rect.width // width
+    top = rect.top + y0 * rect.height // height
+    right = rect.left + x1 * rect.width // width
+    bottom = rect.top + y1 * rect.height // height
+    part = image.subsurface((x0, y0, x1 - x0, y1 - y0))
+    return pygame.transform.scale(part, (right - left, bottom - top)), (left, top)
+
+
+def draw_outline(surface, rect):
+    """One pixel outline that stays put when the map layer is scrolled.
+
+    pygame.draw.rect moves edges lying past the surface onto its border and Surface.fill shifts rects
+    starting left of or above it, so each edge is clipped to the surface before filling.
+    """
+    x, y, width, height = rect
+    bounds = surface.get_rect()
+    for edge in ((x, y, width, 1), (x, y + height - 1, width, 1), (x, y, 1, height), (x + width - 1, y, 1, height)):
+        surface.fill(GRID_LINE_COLOUR, bounds.clip(edge))
+
+
+# === Grid Overlay ===
+def load_highlights(path):
+    """Read highlighted chunk sets, returning [(RGBA colour, {plane or None for all: {(chunk x, chunk y)}})].
+
+    The file is JSON, {set name: [[chunk x, chunk y] or [chunk x, chunk y, plane], ...]}, where chunk
+    coordinates are game tile coordinates divided by 8. Each set takes the next of HIGHLIGHT_COLOURS.
+    """
+    try:
+        with open(path) as f:
+            sets = json.load(f)
+        highlights = []
+        for i, chunks in enumerate(sets.values()):
+            planes = {}
+            for chunk in chunks:
+                plane = chunk[2] if len(chunk) > 2 else None
+                planes.setdefault(plane, set()).add((chunk[0], chunk[1]))
+            highlights.append((HIGHLIGHT_COLOURS[i % len(HIGHLIGHT_COLOURS)], planes))
+        return highlights
+    except (OSError, ValueError, TypeError, IndexError, AttributeError) as e:
+        print(f"Not highlighting chunks from {path}: {e}")
+        return []
+
+
+class GridOverlay:
+    """Chunk and region lines and highlighted chunks, pre-rendered into transparent blocks of the map.
+
+    The blocks are drawn at one settled zoom level and plane, so the overlay costs a blit per block on
+    screen however many lines and chunks it shows. They are dropped when the zoom or plane changes, and
+    version is bumped when the highlight file changes so the map layer redraws. Only the UI thread uses it.
+    """
+
+    def __init__(self, highlight_path=None):
+        self.highlight_path = highlight_path
+        self.highlight_mtime = None
+        self.checked = 0.0
+        self.highlights = []
+        self.version = 0
+        self.view = None  # (zoom, plane) the blocks are drawn at
+        self.blocks = OrderedDict()  # (block x, block y) -> Surface
+        self.patterns = {}  # line phase -> Surface shared by the blocks clear of the map's edges and highlights
+        self.fills = {}  # (block x, block y) -> [(RGBA colour, rect in the block)] of highlighted chunks
+        self.refresh()
+
+    def refresh(self):
+        """Reload the highlight file if it changed, at most every HIGHLIGHT_POLL seconds."""
+        now = time.monotonic()
+        if self.highlight_path is None or now - self.checked < HIGHLIGHT_POLL:
+            return
+        self.checked = now
+        try:
+            mtime = os.stat(self.highlight_path).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime == self.highlight_mtime:
+            return
+        self.highlight_mtime = mtime
+        self.highlights = load_highlights(self.highlight_path) if mtime is not None else []
+        self.view = None
+        self.version += 1
+
+    def set_view(self, zoom, plane):
+        if (zoom, plane) == self.view:
+            return
+        self.view = (zoom, plane)
+        self.blocks.clear()
+        self.patterns.clear()
+
+        # Sort the highlighted chunks into the blocks they fall in, a chunk never straddles two
+        self.fills = {}
+        chunk = int(TILE_SIZE * zoom / GAME_TILES_PER_TILE * CHUNK_SIZE)
+        top = (Y_MAX + 1) * GAME_TILES_PER_TILE // CHUNK_SIZE - 1  # chunk y of the top row of the map
+        for colour, planes in self.highlights:
+            for cx, cy in planes.get(plane, set()) | planes.get(None, set()):
+                x = (cx - X_MIN * GAME_TILES_PER_TILE // CHUNK_SIZE) * chunk
+                y = (top - cy) * chunk
+                block = (x // GRID_BLOCK_SIZE, y // GRID_BLOCK_SIZE)
+                rect = (x % GRID_BLOCK_SIZE, y % GRID_BLOCK_SIZE, chunk, chunk)
+                self.fills.setdefault(block, []).append((colour, rect))
+
+    def block(self, bx, by):
+        surface = self.blocks.get((bx, by))
+        if surface is not None:
+            self.blocks.move_to_end((bx, by))
+            return surface
+
+        zoom, _ = self.view
+        size = GRID_BLOCK_SIZE
+        map_width = int((X_MAX - X_MIN + 1) * TILE_SIZE * zoom)
+        map_height = int((Y_MAX - Y_MIN + 1) * TILE_SIZE * zoom)
+        left, top = bx * size, by * size
+        lines = []  # (step in pixels, RGBA colour)
+        for spacing, colour, min_step in GRID_LINES:
+            step = int(TILE_SIZE * zoom / GAME_TILES_PER_TILE * spacing)
+            if step >= min_step:
+                lines.append((step, colour))
+
+        # Blocks clear of the map's edges and of highlights only differ in where their lines fall
+        pattern = None
+        if lines and (bx, by) not in self.fills and left + size <= map_width and top + size <= map_height:
+            period = math.lcm(*(step for step, _ in lines))
+            pattern = (left % period, top % period)
+            surface = self.patterns.get(pattern)
+
+        if surface is None:
+            surface = pygame.Surface((size, size), pygame.SRCALPHA)
+            for colour, rect in self.fills.get((bx, by), ()):
+                surface.fill(colour, rect)
+
+            # Lines run along the map's edges and every spacing game tiles in between
+            for step, colour in lines:
+                for x in range(-left % step, min(size, map_width - left + 1), step):
+                    surface.fill(colour, (x, 0, 1, min(size, map_height - top)))
+                for y in range(-top % step, min(size, map_height - top + 1), step):
+                    surface.fill(colour, (0, y, min(size, map_width - left), 1))
+            if pattern is not None:
+                self.patterns[pattern] = surface
+
+        self.blocks[(bx, by)] = surface
+        if len(self.blocks) > GRID_CACHE_MAX_BLOCKS:
+            self.blocks.popitem(last=False)
+        return surface
+
+    def draw(self, surface, offset, zoom, plane, area):
+        """Blit the blocks overlapping area, offset being whole pixels as it is once the zoom has settled."""
+        self.set_view(zoom, plane)
+        size = GRID_BLOCK_SIZE
+        bx_max = int((X_MAX - X_MIN + 1) * TILE_SIZE * zoom) // size
+        by_max = int((Y_MAX - Y_MIN + 1) * TILE_SIZE * zoom) // size
+        ox, oy = int(offset[0]), int(offset[1])
+        for bx in range(max(0, (area.left - ox) // size), min(bx_max, (area.right - 1 - ox) // size) + 1):
+            for by in range(max(0, (area.top - oy) // size), min(by_max, (area.bottom - 1 - oy) // size) + 1):
+                surface.blit(self.block(bx, by), (bx * size + ox, by * size + oy))
+
+
+class TextCache:
+    """Rendered overlay text reused across frames, the font is only created once."""
+
+    def __init__(self, font_size=FONT_SIZE, max_entries=TEXT_CACHE_MAX_ENTRIES):
+        self.font = pygame.font.SysFont(None, font_size)
+        self.max_entries = max_entries
+        self.surfaces = OrderedDict()  # (kind, text) -> Surface
+
+    def lookup(self, key):
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.surfaces.move_to_end(key)
+        return surface
+
+    def store(self, key, surface):
+        self.surfaces[key] = surface
+        if len(self.surfaces) > self.max_entries:
+            self.surfaces.popitem(last=False)
+        return surface
+
+    def render(self, text):
+        surface = self.lookup(("text", text))
+        if surface is None:
+            surface = self.store(("text", text), self.font.render(text, True, GRID_LINE_COLOUR))
+        return surface
+
+    def panel(self, text):
+        """Text on a translucent background box."""
+        overlay = self.lookup(("panel", text))
+        if overlay is None:
+            text_surf = self.render(text)
+            overlay_width = text_surf.get_width() + 2 * OVERLAY_PADDING
+            overlay_height = text_surf.get_height() + 2 * OVERLAY_PADDING
+            overlay = pygame.Surface((overlay_width, overlay_height), pygame.SRCALPHA)
+            overlay.fill((0, 0, 0, OVERLAY_BG_ALPHA))
+            overlay.blit(text_surf, (OVERLAY_PADDING, OVERLAY_PADDING))
+            self.store(("panel", text), overlay)
+        return overlay
+
+
+def overlay_lines(state):
     zoom_text = f"Zoom: {state.zoom:.2f}x"
     floor_text = f"Floor (Z): {state.current_z}"
-    lines = [zoom_text, floor_text]
+    return [zoom_text, floor_text]
 
-    for i, text in enumerate(lines):
-        text_surf = font.render(text, True, GRID_LINE_COLOUR)
+
+def draw_overlay(screen, window_size, state, all_tiles_loaded, text_cache):
+    # --- Zoom level and floor ---
+    for i, text in enumerate(overlay_lines(state)):
+        text_surf = text_cache.render(text)
         screen.blit(text_surf, (PADDING_RIGHT, PADDING_TOP + i * (FONT_SIZE + LINE_SPACING)))
 
     # --- Loading message ---
     if not all_tiles_loaded:
-        loading_text = "Loading map tiles..."
-        loading_surf = font.render(loading_text, True, GRID_LINE_COLOUR)
+        overlay = text_cache.panel("Loading map tiles...")
+        pos_x = (window_size[0] - overlay.get_width()) // 2
+        pos_y = window_size[1] - overlay.get_height() - PADDING_TOP
+        screen.blit(overlay, (pos_x, pos_y))
 
-        overlay_width = loading_surf.get_width() + 2 * OVERLAY_PADDING
-        overlay_height = loading_surf.get_height() + 2 * OVERLAY_PADDING
-        overlay = pygame.Surface((overlay_width, overlay_height), pygame.SRCALPHA)
-        overlay.fill((0, 0, 0, OVERLAY_BG_ALPHA))
-        overlay.blit(loading_surf, (OVERLAY_PADDING, OVERLAY_PADDING))
 
-        pos_x = (window_size[0] - overlay_width) // 2
-        pos_y = window_size[1] - overlay_height - PADDING_TOP
-        screen.blit(overlay, (pos_x, pos_y))
+def wait_for_event(timeout):
+    """Sleep until input arrives or timeout seconds pass, unless some is queued already.
+
+    Returns the event waited for, to go to handle_events ahead of the queue, or None.
+    """
+    if pygame.event.peek():
+        return None
+    event = pygame.event.wait(max(1, int(timeout * 1000)))
+    return None if event.type == pygame.NOEVENT else event
 
 
 # === Event Handling ===
-def handle_events(state):
-    for event in pygame.event.get():
+def handle_events(state, waited=None):
+    """Handle the queued input, after the event wait_for_event returned if there is one."""
+    for event in itertools.chain([waited] if waited is not None else [], pygame.event.get()):
         if event.type == pygame.QUIT:
             return False
 
         elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
             state.dragging = True
             state.drag_start = event.pos
-            pygame.mouse.set_cursor(pygame.SYSTEM_CURSOR_HAND)
+            set_cursor(pygame.SYSTEM_CURSOR_HAND)
 
         elif event.type == pygame.MOUSEBUTTONUP and event.button == 1:
             state.dragging = False
-            pygame.mouse.set_cursor(pygame.SYSTEM_CURSOR_ARROW)
+            set_cursor(pygame.SYSTEM_CURSOR_ARROW)
 
         elif event.type == pygame.MOUSEMOTION and state.dragging:
             dx = event.pos[0] - state.drag_start[0]
@@ -212,6 +2117,7 @@ def handle_events(state):
             state.offset[0] += dx
             state.offset[1] += dy
             state.drag_start = event.pos
+            state.drag_samples.append((time.monotonic(), dx, dy))
 
         elif event.type == pygame.MOUSEWHEEL:
             try:
@@ -230,68 +2136,232 @@ def handle_events(state):
                 state.current_z += 1
             elif event.key == pygame.K_DOWN and state.current_z > Z_MIN:
                 state.current_z -= 1
+            elif event.key == PROFILER_HUD_KEY:
+                state.show_profiler = not state.show_profiler
+            elif event.key == GRID_KEY:
+                state.show_grid = not state.show_grid
+
+        elif event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+            state.redraw = True
 
     return True
 
 
+def update_zoom(state):
+    """Step the smooth zoom animation towards zoom_target, keeping the point under the mouse fixed."""
+    if abs(state.zoom - state.zoom_target) <= 0.001:
+        return
+
+    old_zoom = state.zoom
+    if state.zoom < state.zoom_target:
+        state.zoom = min(state.zoom + ZOOM_SPEED, state.zoom_target)
+    elif state.zoom > state.zoom_target:
+        state.zoom = max(state.zoom - ZOOM_SPEED, state.zoom_target)
+
+    # Zoom focal point is the mouse location
+    mx, my = pygame.mouse.get_pos()
+    state.offset[0] = mx - (mx - state.offset[0]) * (state.zoom / old_zoom)
+    state.offset[1] = my - (my - state.offset[1]) * (state.zoom / old_zoom)
+
+    # Settle on whole pixels so that drags can scroll the map layer instead of redrawing it
+    if state.zoom == state.zoom_target:
+        state.offset = [round(state.offset[0]), round(state.offset[1])]
+
+
+def update_velocity(state):
+    """Average the drag motion of the last PREFETCH_VELOCITY_WINDOW seconds into state.velocity."""
+    now = time.monotonic()
+    samples = state.drag_samples
+    while samples and now - samples[0][0] > PREFETCH_VELOCITY_WINDOW:
+        samples.popleft()
+    state.velocity = (
+        sum(dx for _, dx, _ in samples) / PREFETCH_VELOCITY_WINDOW,
+        sum(dy for _, _, dy in samples) / PREFETCH_VELOCITY_WINDOW)
+
+
+def prefetch_views(state, mouse_pos):
+    """Views the user is likely to see next as (offset, zoom, plane), most likely first."""
+    views = []
+    vx, vy = state.velocity
+    if vx or vy:
+        # Where the view will be if the drag keeps going
+        offset = (state.offset[0] + vx * PREFETCH_LOOKAHEAD, state.offset[1] + vy * PREFETCH_LOOKAHEAD)
+        views.append((offset, state.zoom, state.current_z))
+
+    if abs(state.zoom - state.zoom_target) > 0.001:
+        # Where the zoom animation will end, zooming about the mouse like update_zoom
+        mx, my = mouse_pos
+        ratio = state.zoom_target / state.zoom
+        offset = (mx - (mx - state.offset[0]) * ratio, my - (my - state.offset[1]) * ratio)
+        views.append((offset, state.zoom_target, state.current_z))
+
+    if not views:
+        # At rest, warm the floors the arrow keys can switch to
+        for z in (state.current_z + 1, state.current_z - 1):
+            if Z_MIN <= z <= Z_MAX:
+                views.append((tuple(state.offset), state.zoom, z))
+    return views
+
+
 # === Main Loop ===
-def main():
-    screen, window_size = initialize_window()
+def main(window_size=None, frame_callback=None):
+    """Run the viewer.
+
+    frame_callback(frame, state, tile_cache, scheduler) is called at the start of every frame, before
+    events are handled, and stops the viewer by returning False. The benchmark drives the viewer with it.
+    """
+    startup = StartupTimer()
+    screen, window_size = initialize_window(window_size, loading_screen=not FAST_STARTUP)
     state = ViewerState(screen, window_size)
+    state.startup = startup.phases
+    startup.lap("window")
 
-    tile_lock = threading.Lock()
-    tile_queue = PriorityQueue()
+    tile_lock = TimedLock()
+    profiler = FrameProfiler(tile_lock, PROFILER_LOG_PATH)
+    scheduler = TileScheduler()
 
     print("Loading tiles...")
-    loaded_tiles = init_load()
-
-    for z in range(Z_MIN, Z_MAX + 1):
-        for x in range(X_MIN, X_MAX + 1):
-            for y in range(Y_MIN, Y_MAX + 1):
-                key = (z, x, y)
-                if key in loaded_tiles:
-                    continue
-                priority = compute_priority(x, y, z, INIT_CENTER[0], INIT_CENTER[1], INIT_Z)
-                tile_queue.put((priority, key))
+    client = archive = None
+    if TILE_SERVER_URL:
+        print(f"Fetching tiles from tile server {TILE_SERVER_URL}")
+        client = TileClient(TILE_SERVER_URL, TILE_SERVER_CONNECTIONS)
+    manifest = load_manifest(client)
+    if client is None:
+        archive = open_tile_archive(manifest)
+    startup.lap("manifest")
+    if archive is not None:
+        print(f"Reading tiles from archive {map_tools.archive_path(MAP_TILE_DIR)}")
+        present = set(archive.keys())
+    else:
+        present = manifest_keys(manifest)
+    tile_cache = TileCache(TILE_CACHE_MAX_TILES, TILE_CACHE_MAX_BYTES)
+    tile_cache.present = present
+    startup.lap("tile_keys")
+    tile_cache.blob_of = load_dedup_index(manifest) if client is None else {}
+    startup.lap("dedup")
+    scaled_cache = ScaledTileCache(SCALED_CACHE_MAX_BYTES)
+    map_layer = MapLayer(window_size)
+    grid = GridOverlay(HIGHLIGHT_CHUNKS_PATH)
+    text_cache = TextCache()
+    max_level = detect_pyramid_levels(present)
+    print(f"Tiles in manifest: {len(present)}, zoom pyramid levels available: {max_level}")
+    if not FAST_STARTUP:
+        for key, image in init_load(present, archive, client).items():
+            tile_cache.put(key, image)
+        startup.lap("init_load")
+
+    # Only queue full-resolution tiles that exist, a batch per frame from the start position outwards.
+    # The visible tiles are requested by the first frame ahead of all of them
+    backlog = keys_by_distance(present, (INIT_CENTER[0], INIT_CENTER[1], INIT_Z))
 
     # Launch thread and keep reference
-    tile_thread = threading.Thread(
-        target=tile_loader_thread, args=(tile_queue, loaded_tiles, tile_lock), daemon=True)
+    decode_pool = None
+    if client is not None:
+        # One loader per pooled connection, so requests are in flight while others decode
+        for _ in range(TILE_SERVER_CONNECTIONS - 1):
+            threading.Thread(
+                target=server_loader_thread, args=(scheduler, tile_cache, tile_lock, client, profiler),
+                daemon=True).start()
+        tile_thread = threading.Thread(
+            target=server_loader_thread, args=(scheduler, tile_cache, tile_lock, client, profiler), daemon=True)
+    elif archive is not None:
+        tile_thread = threading.Thread(
+            target=archive_loader_thread, args=(scheduler, tile_cache, tile_lock, archive, profiler), daemon=True)
+    elif DECODE_WORKERS > 0:
+        decode_pool = DecodePool(DECODE_WORKERS)
+        tile_thread = threading.Thread(
+            target=pooled_loader_thread, args=(scheduler, tile_cache, tile_lock, decode_pool, profiler),
+            daemon=True)
+    else:
+        tile_thread = threading.Thread(
+            target=tile_loader_thread, args=(scheduler, tile_cache, tile_lock, profiler), daemon=True)
     tile_thread.start()
     all_tiles_loaded = False
 
+    # The archive and the tile server are not rewritten tile by tile, only the loose PNGs are watched
+    watcher = None
+    if WATCH_TILE_DIR and archive is None and client is None:
+        watcher = TileWatcher(MAP_TILE_DIR, manifest)
+        watcher.start()
+    startup.lap("threads")
+
     # Center map on the initial tile
     state.offset[0] = state.window_width // 2 - int((INIT_CENTER[0] - X_MIN + 0.5) * TILE_SIZE)
     state.offset[1] = state.window_height // 2 - int((Y_MAX - INIT_CENTER[1] + 0.5) * TILE_SIZE)
 
+    frame = 0
+    last_overlay = None
+    waited = None
     running = True
     while running:
-        if not handle_events(state):
+        if frame_callback is not None and not frame_callback(frame, state, tile_cache, scheduler):
+            break
+        frame += 1
+        profiler.start_frame()
+
+        if not handle_events(state, waited):
             break
+        waited = None
 
-        if not all_tiles_loaded and not tile_thread.is_alive():
-            print(f"Loaded {len(loaded_tiles)} tiles. Loading complete ✅")
-            all_tiles_loaded = True
+        # The background queue only starts filling once the first frame is on screen
+        if backlog is not None and state.frames_drawn and not queue_startup_tiles(
+                backlog, scheduler, tile_cache, tile_lock):
+            backlog = None
+        queue_drained = backlog is None and scheduler.idle()
+        if queue_drained and not all_tiles_loaded:
+            print(f"Loaded {len(tile_cache)} tiles. Loading complete ✅")
+        all_tiles_loaded = queue_drained
 
         # Handle zoom smooth transition
-        if abs(state.zoom - state.zoom_target) > 0.001:
-            old_zoom = state.zoom
-            if state.zoom < state.zoom_target:
-                state.zoom = min(state.zoom + ZOOM_SPEED, state.zoom_target)
-            elif state.zoom > state.zoom_target:
-                state.zoom = max(state.zoom - ZOOM_SPEED, state.zoom_target)
-
-            # Zoom focal point is the mouse location
-            mx, my = pygame.mouse.get_pos()
-            state.offset[0] = mx - (mx - state.offset[0]) * (state.zoom / old_zoom)
-            state.offset[1] = my - (my - state.offset[1]) * (state.zoom / old_zoom)
-
-        draw_tiles_and_grid(
-            screen, loaded_tiles, state.offset, state.zoom, 
-            state.current_z, window_size, tile_lock)
-        draw_overlay(screen, window_size, state, all_tiles_loaded)
+        update_zoom(state)
+        update_velocity(state)
+        profiler.lap("events")
+
+        if watcher is not None:
+            max_level = apply_tile_changes(
+                watcher, tile_cache, scaled_cache, map_layer, scheduler, tile_lock, max_level)
+        request_visible_tiles(
+            scheduler, tile_cache, tile_lock, state.offset, state.zoom,
+            state.current_z, window_size, max_level, prefetch_views(state, pygame.mouse.get_pos()))
+        profiler.lap("requests")
+        grid.refresh()
+        map_changed = map_layer.update(tile_cache, scaled_cache, grid, state, tile_lock, max_level, profiler)
+
+        # Nothing changed on screen, sleep until input arrives or it is time to look for loaded tiles
+        overlay = (overlay_lines(state), all_tiles_loaded, state.show_profiler)
+        hud_due = state.show_profiler and profiler.hud_stale()
+        if not (map_changed or overlay != last_overlay or hud_due or state.redraw):
+            busy = not all_tiles_loaded or scaled_cache.rough
+            waited = wait_for_event(RENDER_LOADING_POLL if busy else RENDER_IDLE_POLL)
+            continue
+        last_overlay = overlay
+        state.redraw = False
+
+        screen.blit(map_layer.surface, (0, 0))
+        draw_overlay(screen, window_size, state, all_tiles_loaded, text_cache)
+        profiler.lap("overlay")
+        if state.show_profiler:
+            profiler.draw_hud(screen, window_size)
+        profiler.lap("hud")
         pygame.display.flip()  # Update the screen
+        profiler.lap("flip")
+        profiler.end_frame(tile_cache, scaled_cache, scheduler)
+        state.frames_drawn += 1
+        if state.frames_drawn == 1:
+            startup.lap("first_frame")
+            startup.report()
 
+    with tile_lock:
+        print(f"Tile cache stats: {tile_cache.stats()}")
+    print(f"Scaled tile cache stats: {scaled_cache.stats()}")
+    print(f"Scheduler stats: {scheduler.stats()}")
+    if watcher is not None:
+        print(f"Tile watcher stats: {watcher.stats()}")
+    if decode_pool is not None:
+        decode_pool.close()
+    if client is not None:
+        client.close()
+    profiler.close()
     pygame.quit()
 
 